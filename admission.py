@@ -0,0 +1,157 @@
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Tuple
+from astrbot.api import logger
+
+
+class AdmissionRejected(Exception):
+    """指令执行请求被准入控制拒绝"""
+
+
+class AdmissionController:
+    """伪造事件注入的准入控制
+
+    限制同时在事件队列中执行的指令数（全局、每个会话、每个映射），
+    超出限制的请求进入有界等待队列，队列已满或等待超时则立即拒绝，
+    避免大量工具调用挤占真实用户消息的处理。所有上限为 0 时表示不限制。
+
+    等待者按到达顺序排队，归还许可时直接把空出的许可交给最早的可放行等待者，
+    新到的请求无法抢在等待者之前拿走刚空出的许可；
+    只受会话或映射上限阻塞的等待者不会挡住其他会话、映射的等待者。
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_per_session: int = 3, max_per_mapping: int = 0,
+                 max_waiting: int = 32, wait_timeout: float = 10.0):
+        self.max_concurrency = max_concurrency
+        self.max_per_session = max_per_session
+        self.max_per_mapping = max_per_mapping
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+
+        # 等待者队列：(许可交付信号, 会话, 映射, 映射上限)
+        self._waiters: Deque[Tuple[asyncio.Future, str, str, int]] = deque()
+        self.in_flight = 0
+        self.session_in_flight: Dict[str, int] = {}
+        self.mapping_in_flight: Dict[str, int] = {}
+
+        # 指标
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @classmethod
+    def from_config(cls, config) -> "AdmissionController":
+        """从插件配置构建准入控制器"""
+        config = config or {}
+        return cls(
+            max_concurrency=int(config.get("max_concurrency", 8)),
+            max_per_session=int(config.get("max_concurrency_per_session", 3)),
+            max_per_mapping=int(config.get("max_concurrency_per_mapping", 0)),
+            max_waiting=int(config.get("admission_queue_size", 32)),
+            wait_timeout=float(config.get("admission_wait_timeout", 10.0)),
+        )
+
+    def _can_admit(self, session_key: str, mapping_key: str, mapping_limit: int) -> bool:
+        """检查各级并发上限"""
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            return False
+        if self.max_per_session and self.session_in_flight.get(session_key, 0) >= self.max_per_session:
+            return False
+        if mapping_limit and self.mapping_in_flight.get(mapping_key, 0) >= mapping_limit:
+            return False
+        return True
+
+    def _enter(self, session_key: str, mapping_key: str):
+        """占用执行许可"""
+        self.in_flight += 1
+        self.session_in_flight[session_key] = self.session_in_flight.get(session_key, 0) + 1
+        self.mapping_in_flight[mapping_key] = self.mapping_in_flight.get(mapping_key, 0) + 1
+        self.admitted += 1
+
+    def _leave(self, counters: Dict[str, int], key: str):
+        """减少计数，归零时移除键"""
+        count = counters.get(key, 0) - 1
+        if count > 0:
+            counters[key] = count
+        else:
+            counters.pop(key, None)
+
+    async def acquire(self, session_key: str, mapping_key: str, mapping_limit: int = None):
+        """申请执行许可，无法获得时抛出 AdmissionRejected
+
+        Args:
+            session_key: 会话标识（unified_msg_origin）
+            mapping_key: 映射标识（指令名）
+            mapping_limit: 该映射的并发上限，为空时使用全局的每映射上限
+        """
+        if mapping_limit is None:
+            mapping_limit = self.max_per_mapping
+
+        # 等待者都已确认无法放行（每次归还许可后都会重新检查），新请求可放行时不会占用等待者能用的许可
+        if self._can_admit(session_key, mapping_key, mapping_limit):
+            self._enter(session_key, mapping_key)
+            return
+
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            logger.warning(f"准入等待队列已满（{self.waiting}），拒绝指令 {mapping_key}")
+            raise AdmissionRejected("当前指令调用过多，请稍后再试")
+
+        granted = asyncio.get_running_loop().create_future()
+        waiter = (granted, session_key, mapping_key, mapping_limit)
+        self._waiters.append(waiter)
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            await asyncio.wait({granted}, timeout=self.wait_timeout)
+        except asyncio.CancelledError:
+            # 调用方被取消：许可已交付时归还，否则退出队列
+            if granted.done():
+                self._release(session_key, mapping_key)
+            else:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            self.waiting -= 1
+
+        if not granted.done():
+            self._waiters.remove(waiter)
+            self.timed_out += 1
+            self.rejected += 1
+            logger.warning(f"等待执行许可超过 {self.wait_timeout} 秒，拒绝指令 {mapping_key}")
+            raise AdmissionRejected(f"等待执行超过 {self.wait_timeout} 秒，请稍后再试")
+
+    def _grant_waiters(self):
+        """按到达顺序把许可交给可以放行的等待者"""
+        for waiter in list(self._waiters):
+            granted, session_key, mapping_key, mapping_limit = waiter
+            if self._can_admit(session_key, mapping_key, mapping_limit):
+                self._waiters.remove(waiter)
+                self._enter(session_key, mapping_key)
+                granted.set_result(True)
+
+    def _release(self, session_key: str, mapping_key: str):
+        self.in_flight -= 1
+        self._leave(self.session_in_flight, session_key)
+        self._leave(self.mapping_in_flight, mapping_key)
+        if self._waiters:
+            self._grant_waiters()
+
+    async def release(self, session_key: str, mapping_key: str):
+        """归还执行许可并交给等待者"""
+        self._release(session_key, mapping_key)
+
+    def snapshot(self) -> Dict[str, int]:
+        """当前队列深度与计数指标"""
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "peak_waiting": self.peak_waiting,
+            "active_sessions": len(self.session_in_flight),
+            "active_mappings": len(self.mapping_in_flight),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
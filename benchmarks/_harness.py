@@ -0,0 +1,47 @@
+"""性能测试脚本的公共部分：以包的形式加载插件，并提供模拟的 AstrBot 核心上下文
+
+脚本需要在已安装 AstrBot 的环境中运行，例如在 AstrBot 根目录下执行：
+    python data/plugins/astrbot_plugin_command_to_llm/benchmarks/bench_capture_latency.py
+"""
+import sys
+import asyncio
+import importlib
+from pathlib import Path
+from astrbot.core.message.message_event_result import MessageChain
+from astrbot.core.message.components import Plain
+
+PLUGIN_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PLUGIN_DIR.parent))
+
+
+def load(module: str):
+    """按插件包导入插件中的模块"""
+    return importlib.import_module(f"{PLUGIN_DIR.name}.{module}")
+
+
+class FakeContext:
+    """只实现触发指令用到的接口：事件队列、平台实例和全局配置"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def get_event_queue(self):
+        return self.queue
+
+    def get_platform_inst(self, platform_id):
+        return None
+
+    def get_config(self):
+        return {}
+
+
+async def run_core(context: FakeContext, reply):
+    """模拟事件处理流水线：逐个取出提交的事件，在独立任务中调用 reply(event) 生成响应"""
+    while True:
+        event = await context.queue.get()
+        asyncio.create_task(reply(event))
+
+
+def reply_text(text: str) -> MessageChain:
+    """构造纯文本响应的消息链"""
+    return MessageChain([Plain(text)])
@@ -0,0 +1,40 @@
+"""EventFactory 创建伪造事件的耗时
+
+分别测量平台解析结果已缓存时，以及每次调用前清空平台解析缓存（相当于缓存之前每次都重新解析平台）时
+create_event 的单次耗时。
+"""
+import timeit
+import logging
+import argparse
+from _harness import FakeContext, load
+
+
+def main(number: int, umo: str):
+    factory = load("event_factory").EventFactory(FakeContext())
+
+    def create():
+        factory.create_event(umo, "/rmd ls", "user", "nick")
+
+    def create_uncached():
+        factory.invalidate_platform_cache()
+        factory.create_event(umo, "/rmd ls", "user", "nick")
+
+    create()
+    # 清空缓存时的日志与无法推断平台的警告不计入耗时
+    logging.disable(logging.WARNING)
+    try:
+        cached = timeit.timeit(create, number=number) / number * 1e6
+        uncached = timeit.timeit(create_uncached, number=number) / number * 1e6
+    finally:
+        logging.disable(logging.NOTSET)
+
+    print(f"{umo}，{number} 次")
+    print(f"平台解析已缓存 {cached:.1f} us/次，每次重新解析 {uncached:.1f} us/次")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="每种情况的调用次数")
+    parser.add_argument("--umo", default="my_dingtalk_bot:GroupMessage:123_456", help="会话标识")
+    args = parser.parse_args()
+    main(args.number, args.umo)
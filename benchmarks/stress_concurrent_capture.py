@@ -0,0 +1,55 @@
+"""大量并发调用下的捕获隔离压力测试
+
+数百个调用同时触发，分布在少量会话中（同一会话内也有并发），每个处理函数以随机延迟分多条回复。
+检查每个调用只捕获到自己的全部响应且顺序正确，结束后没有残留的捕获会话；发现串扰时以非零状态退出。
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+from _harness import FakeContext, load, reply_text, run_core
+
+PARTS = 3  # 每次调用的回复条数
+
+
+async def main(count: int, sessions: int) -> bool:
+    CommandTrigger = load("command_trigger").CommandTrigger
+    CapturePolicy = load("capture_session").CapturePolicy
+    context = FakeContext()
+
+    async def reply(event):
+        for part in range(PARTS):
+            await asyncio.sleep(random.random() * 0.05)
+            await event.send(reply_text(f"{event.message_str}#{part}"))
+
+    core = asyncio.create_task(run_core(context, reply))
+    # 不限制并发，让所有调用同时进行
+    trigger = CommandTrigger(context, {"max_concurrency": 0, "max_concurrency_per_session": 0})
+    policy = CapturePolicy(CapturePolicy.MAX_MESSAGES, timeout=10, quiet_period=1, max_messages=PARTS)
+
+    async def one(i: int) -> bool:
+        command = f"/stress {i}"
+        success, messages = await trigger.trigger_and_capture_command(
+            f"stress:GroupMessage:{i % sessions}", command, f"user{i}", policy=policy
+        )
+        texts = [message.chain[0].text for message in messages]
+        return success and texts == [f"{command}#{part}" for part in range(PARTS)]
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(count)))
+    elapsed = time.perf_counter() - started
+    core.cancel()
+
+    failed = results.count(False)
+    print(f"{count} 个并发调用（{sessions} 个会话），耗时 {elapsed:.2f} 秒")
+    print(f"结果不符 {failed} 个，残留捕获会话 {len(trigger.sessions)} 个")
+    return failed == 0 and not trigger.sessions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=300, help="并发调用数")
+    parser.add_argument("--sessions", type=int, default=20, help="会话数")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(main(args.count, args.sessions)) else 1)
@@ -0,0 +1,179 @@
+import time
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional
+from astrbot.api import logger
+from astrbot.core.message.message_event_result import MessageChain
+from .tracing import tracer
+
+
+class CapturePolicy:
+    """捕获策略，决定一次指令调用何时视为响应完整
+
+    - first: 捕获到第一条消息即返回
+    - quiet: 最后一条消息之后静默 quiet_period 秒即返回
+    - max_messages: 捕获到 max_messages 条消息即返回（未达到时按静默期返回）
+    - pipeline: 等待流水线结束信号（无结束信号的平台按静默期返回）
+
+    所有策略在流水线结束或总超时 timeout 到达时都会立即结束。
+    """
+
+    FIRST = "first"
+    QUIET = "quiet"
+    MAX_MESSAGES = "max_messages"
+    PIPELINE = "pipeline"
+    MODES = (FIRST, QUIET, MAX_MESSAGES, PIPELINE)
+
+    def __init__(self, mode: str = FIRST, timeout: float = 20.0, quiet_period: float = 1.0, max_messages: int = 5):
+        self.mode = mode if mode in self.MODES else self.FIRST
+        self.timeout = timeout
+        self.quiet_period = quiet_period
+        self.max_messages = max(1, max_messages)
+
+    @property
+    def uses_quiet_period(self) -> bool:
+        """是否启用静默期检测"""
+        return self.mode != self.FIRST and self.quiet_period > 0
+
+    @classmethod
+    def from_config(cls, config, mapping: Optional[Dict] = None) -> "CapturePolicy":
+        """从插件配置构建捕获策略，指令映射中的同名字段优先"""
+        config = config or {}
+        mapping = mapping or {}
+
+        def pick(key, default, cast):
+            value = mapping.get(key, config.get(key, default))
+            try:
+                return cast(value)
+            except (TypeError, ValueError):
+                logger.warning(f"捕获策略参数 {key}={value!r} 无效，使用默认值 {default}")
+                return default
+
+        return cls(
+            mode=pick("capture_policy", cls.FIRST, str),
+            timeout=pick("capture_timeout", 20.0, float),
+            quiet_period=pick("capture_quiet_period", 1.0, float),
+            max_messages=pick("capture_max_messages", 5, int),
+        )
+
+    def __repr__(self):
+        return f"CapturePolicy(mode={self.mode}, timeout={self.timeout}, quiet_period={self.quiet_period}, max_messages={self.max_messages})"
+
+
+class CaptureSession:
+    """单次指令调用的捕获会话，每个伪造事件独享自己的响应缓冲区与完成信号"""
+
+    def __init__(self, target_event):
+        self.target_event = target_event
+        self.message_id = target_event.message_obj.message_id  # 伪造事件的唯一消息ID，用于关联响应与调用
+        self.started_at = time.monotonic()
+        self.first_response_at = None  # 收到第一条响应的时间
+        self.captured_messages: List[MessageChain] = []
+        self.original_send_method = target_event.send  # 保存原始的send方法
+        self.changed_event = asyncio.Event()  # 新消息或流水线结束时触发
+        self.finished = False  # 流水线是否已报告结束
+
+    def install(self):
+        """替换目标事件的send方法，开始捕获"""
+        self.target_event.send = self._intercepted_send
+        tracer.debug("已设置消息拦截器，监听事件: %s (%s)", self.target_event.unified_msg_origin, self.message_id)
+
+    def restore(self):
+        """恢复目标事件原始的send方法"""
+        if self.original_send_method is not None:
+            self.target_event.send = self.original_send_method
+            tracer.debug("已恢复原始消息发送器 (%s)", self.message_id)
+
+    async def _intercepted_send(self, message_chain):
+        """拦截器：捕获消息而不实际发送到平台"""
+        if message_chain is None:
+            # 流水线在事件处理结束时会发送 None
+            self.mark_finished()
+            return True
+        
+        self.capture(message_chain)
+
+        # 设置已发送标记，但不实际发送到平台
+        self.target_event._has_send_oper = True
+        return True
+
+    def capture(self, message_chain):
+        """记录一条响应消息并通知等待方"""
+        if self.first_response_at is None:
+            self.first_response_at = time.monotonic()
+        
+        if hasattr(message_chain, 'chain'):
+            tracer.debug("捕获到指令响应消息 (%s)，包含 %d 个组件，距提交 %.0f ms",
+                         self.message_id, len(message_chain.chain), self.elapsed_ms())
+        else:
+            # 即使格式不正确，也记录为已捕获
+            tracer.debug("捕获到指令响应消息 (%s)，但格式不正确", self.message_id)
+        self.captured_messages.append(message_chain)
+
+        # 通知等待方
+        self.changed_event.set()
+
+    def elapsed_ms(self) -> float:
+        """距会话创建经过的毫秒数"""
+        return (time.monotonic() - self.started_at) * 1000
+
+    def first_response_ms(self):
+        """首条响应延迟（毫秒），尚未收到响应时为None"""
+        if self.first_response_at is None:
+            return None
+        return (self.first_response_at - self.started_at) * 1000
+
+    def mark_finished(self):
+        """标记流水线已结束处理该事件"""
+        self.finished = True
+        self.changed_event.set()
+
+    def is_complete(self, policy: CapturePolicy) -> bool:
+        """按策略判断是否已捕获到完整响应"""
+        if self.finished:
+            return True
+        count = len(self.captured_messages)
+        if policy.mode == CapturePolicy.FIRST:
+            return count >= 1
+        if policy.mode == CapturePolicy.MAX_MESSAGES:
+            return count >= policy.max_messages
+        return False
+
+    async def wait(self, policy: CapturePolicy) -> bool:
+        """按捕获策略等待响应，返回是否捕获到消息或流水线已结束"""
+        async for _ in self.stream(policy):
+            pass
+        return bool(self.captured_messages) or self.finished
+
+    async def stream(self, policy: CapturePolicy) -> AsyncIterator[MessageChain]:
+        """按捕获策略逐条产出响应消息，每条消息捕获后立即产出，结束条件与 wait 相同"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + policy.timeout
+        index = 0
+
+        while True:
+            while index < len(self.captured_messages):
+                yield self.captured_messages[index]
+                index += 1
+            if self.is_complete(policy):
+                break
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+
+            # 已有消息时只需再等待一个静默期
+            quiet_wait = bool(self.captured_messages) and policy.uses_quiet_period and policy.quiet_period < remaining
+            wait_time = policy.quiet_period if quiet_wait else remaining
+
+            self.changed_event.clear()
+            try:
+                await asyncio.wait_for(self.changed_event.wait(), timeout=wait_time)
+            except asyncio.TimeoutError:
+                if quiet_wait:
+                    tracer.debug("静默 %s 秒未收到新消息，结束捕获 (%s)", policy.quiet_period, self.message_id)
+                    break
+
+        # 结束前到达的消息
+        while index < len(self.captured_messages):
+            yield self.captured_messages[index]
+            index += 1
@@ -1,48 +1,143 @@
 import asyncio
-from typing import List, Tuple
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from astrbot.api import logger
 from astrbot.core.message.message_event_result import MessageChain
 from .command_trigger import CommandTrigger
+from .capture_session import CapturePolicy
+from .admission import AdmissionRejected
+from .tracing import tracer
 
 
 class CommandExecutor:
     """指令执行器，使用CommandTrigger来执行指令并捕获结果"""
     
-    def __init__(self, context):
+    # 相同请求合并范围
+    DEDUP_OFF = "off"
+    DEDUP_SESSION = "session"  # 同一会话内合并
+    DEDUP_USER = "user"  # 同一平台的同一用户合并
+    DEDUP_GLOBAL = "global"  # 所有会话合并
+    
+    def __init__(self, context, config=None):
         self.context = context
-        self.command_trigger = CommandTrigger(context)
+        self.command_trigger = CommandTrigger(context, config)
+        self.inflight: Dict[Tuple, asyncio.Future] = {}  # 进行中的指令执行
+    
+    def _dedup_key(self, scope: str, unified_msg_origin: str, command: str, creator_id: str) -> Optional[Tuple]:
+        """按合并范围生成进行中请求的键，不合并时返回None"""
+        if scope == self.DEDUP_SESSION:
+            return (command, unified_msg_origin)
+        if scope == self.DEDUP_USER:
+            return (command, unified_msg_origin.split(":", 1)[0], creator_id)
+        if scope == self.DEDUP_GLOBAL:
+            return (command,)
+        return None
     
-    async def execute_command(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None) -> Tuple[bool, List[MessageChain]]:
-        """执行指令并捕获响应"""
+    async def execute_command(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None,
+                              policy: CapturePolicy = None, dedup_scope: str = DEDUP_OFF,
+                              mapping_key: str = None, mapping_limit: int = None,
+                              dispatch_mode: str = CommandTrigger.DISPATCH_QUEUE) -> Tuple[bool, List[MessageChain]]:
+        """执行指令并捕获响应
+        
+        Args:
+            dedup_scope: 相同请求合并范围，范围内同时进行的相同指令只实际执行一次，共享捕获结果
+            mapping_key: 映射标识，用于按映射限制并发
+            mapping_limit: 该映射的并发上限，为空时使用全局配置
+            dispatch_mode: 执行方式，queue 提交到事件队列，direct 直接调用处理函数
+        
+        Raises:
+            AdmissionRejected: 并发已满，请求被拒绝
+        """
+        key = self._dedup_key(dedup_scope, unified_msg_origin, command, creator_id)
+        if key is None:
+            return await self._execute_command(unified_msg_origin, command, creator_id, creator_name, policy,
+                                               mapping_key, mapping_limit, dispatch_mode)
+        
+        inflight = self.inflight.get(key)
+        if inflight is not None:
+            tracer.debug("指令 %s 已在执行中，等待共享结果", command)
+            self.command_trigger.metrics.incr(mapping_key or command, "dedup_shared")
+            # shield 防止某个等待方被取消时连带取消共享的执行结果
+            result = await asyncio.shield(inflight)
+            if isinstance(result, AdmissionRejected):
+                raise AdmissionRejected(str(result))
+            success, captured_messages = result
+            return success, list(captured_messages)
+        
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        result = (False, [])
         try:
-            logger.info(f"开始执行指令: {command}")
+            result = await self._execute_command(unified_msg_origin, command, creator_id, creator_name, policy,
+                                                 mapping_key, mapping_limit, dispatch_mode)
+            return result
+        except AdmissionRejected as e:
+            result = e
+            raise
+        finally:
+            # 执行方被取消时等待方得到失败结果
+            self.inflight.pop(key, None)
+            future.set_result(result)
+    
+    async def _execute_command(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None,
+                               policy: CapturePolicy = None, mapping_key: str = None,
+                               mapping_limit: int = None,
+                               dispatch_mode: str = CommandTrigger.DISPATCH_QUEUE) -> Tuple[bool, List[MessageChain]]:
+        """实际执行指令并捕获响应"""
+        try:
+            tracer.debug("开始执行指令: %s", command)
             
             # 使用CommandTrigger来触发指令并捕获响应
             success, captured_messages = await self.command_trigger.trigger_and_capture_command(
-                unified_msg_origin, command, creator_id, creator_name
+                unified_msg_origin, command, creator_id, creator_name, policy, mapping_key, mapping_limit,
+                dispatch_mode
             )
             
             if success:
-                logger.info(f"成功执行指令 {command}，捕获到 {len(captured_messages)} 条响应")
+                tracer.debug("成功执行指令 %s，捕获到 %d 条响应", command, len(captured_messages))
                 return True, captured_messages
             else:
                 logger.warning(f"指令 {command} 执行失败，未捕获到响应")
                 return False, []
                 
+        except AdmissionRejected:
+            raise
         except Exception as e:
             logger.error(f"执行指令失败: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
             return False, []
     
-    async def execute_and_forward(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None):
+    async def stream_command(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None,
+                             policy: CapturePolicy = None, mapping_key: str = None, mapping_limit: int = None,
+                             dispatch_mode: str = CommandTrigger.DISPATCH_QUEUE) -> AsyncIterator[MessageChain]:
+        """执行指令并逐条产出捕获到的响应，流式执行不参与相同请求合并
+        
+        Raises:
+            AdmissionRejected: 并发已满，请求被拒绝
+        """
+        try:
+            tracer.debug("开始流式执行指令: %s", command)
+            async for message_chain in self.command_trigger.trigger_and_stream_command(
+                unified_msg_origin, command, creator_id, creator_name, policy, mapping_key, mapping_limit,
+                dispatch_mode
+            ):
+                yield message_chain
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"流式执行指令失败: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+    
+    async def execute_and_forward(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None,
+                                  policy: CapturePolicy = None):
         """执行指令并转发结果"""
         try:
-            logger.info(f"开始执行并转发指令: {command}")
+            tracer.debug("开始执行并转发指令: %s", command)
             
             # 使用CommandTrigger来触发指令并转发结果
             await self.command_trigger.trigger_and_forward_command(
-                unified_msg_origin, command, creator_id, creator_name
+                unified_msg_origin, command, creator_id, creator_name, policy
             )
             
         except Exception as e:
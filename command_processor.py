@@ -1,107 +1,191 @@
+import time
 import asyncio
+from typing import AsyncIterator, Dict, List, Optional
 from astrbot.api.event import AstrMessageEvent
 from astrbot.api import logger
 from astrbot.api.message_components import Plain
+from astrbot.core.message.message_event_result import MessageChain
 from .data_manager import DataManager
-from .utils import CommandUtils
+from .utils import CommandUtils, MappingSerializer
 from .command_executor import CommandExecutor
+from .execution_plan import ExecutionPlan
+from .result_cache import ResultCache
+from .admission import AdmissionRejected
+from .forward_outbox import ForwardOutbox
+from .text_extractor import TextExtractor
+from .tracing import tracer
 
 class CommandProcessor:
+    # 自动计算批量执行单条时限时，在等待与捕获时间之外留出的余量（秒）
+    ITEM_TIMEOUT_MARGIN = 5.0
+
     def __init__(self, star_instance):
         self.star = star_instance
         self.context = star_instance.context
         self.data_manager = star_instance.data_manager
-        self.command_executor = CommandExecutor(self.context)
+        self.config = star_instance.config
+        self.command_executor = CommandExecutor(self.context, self.config)
+        self.result_cache = ResultCache(int(self.config.get("cache_max_size", 256)))
+        self.plans: Dict[str, ExecutionPlan] = {}  # 指令名 -> 执行计划
+        self.send_scheduler = self.command_executor.command_trigger.send_scheduler  # 按平台限速发送
+        self.metrics = self.command_executor.command_trigger.metrics  # 按映射统计的执行指标
+        self.forward_outbox = ForwardOutbox(self.send_scheduler, int(self.config.get("forward_queue_size", 32)),
+                                            self.metrics)
+        self.async_forward = bool(self.config.get("async_forward", True))  # 是否在后台转发结果
+        self.text_extractor = TextExtractor.from_config(self.config)  # 结果文本提取与长度限制
+        
+        # 定期把指标导出为 Prometheus 文本文件
+        self.metrics_file = self.data_manager.data_dir / "metrics.prom"
+        self.metrics.start_export(self.metrics_file, float(self.config.get("metrics_export_interval", 0)))
+
+    def get_plan(self, command_text: str) -> Optional[ExecutionPlan]:
+        """获取指令的执行计划，映射变化后自动重新编译"""
+        mapping = self.data_manager.command_mappings.get(command_text)
+        if mapping is None:
+            self.plans.pop(command_text, None)
+            return None
+        
+        plan = self.plans.get(command_text)
+        # 映射更新时总是替换为新的映射对象，对象不同即说明计划已过期
+        if plan is None or plan.source is not mapping:
+            plan = ExecutionPlan.compile(command_text, mapping, self.config)
+            self.plans[command_text] = plan
+        return plan
 
     async def execute_command(self, event, command_text: str, args: str = "") -> str:
         """执行指令"""
+        trace = tracer.begin()
         try:
-            # 查找指令映射
-            mapping = self.data_manager.get_mapping(command_text)
-            if not mapping:
+            # 查找指令映射的执行计划
+            plan = self.get_plan(command_text)
+            if plan is None:
                 return f"错误：未找到指令 '{command_text}' 的映射。请先使用 add_command_mapping 添加映射。"
             
-            llm_function = mapping.get("llm_function")
-            description = mapping.get("description", "")
+            tracer.info("执行指令映射: %s -> %s，参数: %r", command_text, plan.llm_function, args)
+            # 每次调用都计数，包括命中缓存、合并到进行中请求和被拒绝的调用
+            self.metrics.incr(command_text, "calls")
             
-            logger.info(f"执行指令映射: {command_text} -> {llm_function}")
+            # 获取用户信息
+            unified_msg_origin = event.unified_msg_origin
+            creator_id = event.get_sender_id()
+            creator_name = event.get_sender_name()
             
-            # 构建完整指令
-            full_command = f"/{command_text}"
-            if args:
-                full_command += f" {args}"
+            # 启用缓存的映射先查缓存，命中时直接返回（结果在首次执行时已转发到会话）
+            cache_key = (command_text, args, unified_msg_origin, creator_id)
+            if plan.cache_ttl > 0:
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    tracer.info("指令 %s 命中结果缓存", command_text)
+                    self.metrics.incr(command_text, "cache_hits")
+                    return cached
             
-            # 获取用户信息
-            creator_id = event.get_sender_id() if hasattr(event, 'get_sender_id') else "user"
-            creator_name = None
-            if hasattr(event, 'message_obj') and hasattr(event.message_obj, 'sender'):
-                creator_name = event.message_obj.sender.nickname
-            
-            # 使用指令执行器执行指令
-            success, captured_messages = await self.command_executor.execute_command(
-                event.unified_msg_origin, full_command, creator_id, creator_name
-            )
-            
-            if success and captured_messages:
-                # 主动发送转发消息（类似旧插件的机制）
-                logger.info(f"[command_processor] 开始主动发送转发消息")
-                
-                for i, captured_msg in enumerate(captured_messages):
-                    if captured_msg is not None:
-                        logger.info(f"[command_processor] 发送第 {i+1} 条转发消息")
-                        
-                        # 构建转发消息
-                        from astrbot.core.message.message_event_result import MessageChain
-                        from astrbot.api.message_components import Plain
-                        
-                        forward_msg = MessageChain()
-                        forward_msg.chain.append(Plain(f"[指令执行] {command_text}\n"))
-                        
-                        # 添加捕获到的消息内容
-                        if hasattr(captured_msg, 'chain') and captured_msg.chain:
-                            for component in captured_msg.chain:
-                                forward_msg.chain.append(component)
-                        
-                        # 发送转发消息
-                        await self.context.send_message(event.unified_msg_origin, forward_msg)
-                        
-                        # 如果有多条消息，添加间隔
-                        if len(captured_messages) > 1 and i < len(captured_messages) - 1:
-                            await asyncio.sleep(0.5)
-                
-                # 提取响应文本用于返回给LLM函数
-                response_texts = []
-                for msg_chain in captured_messages:
-                    if msg_chain is not None:
-                        # 尝试不同的方法获取文本
-                        text = None
-                        if hasattr(msg_chain, 'get_plain_text'):
-                            text = msg_chain.get_plain_text()
-                        elif hasattr(msg_chain, 'to_plain_text'):
-                            text = msg_chain.to_plain_text()
-                        elif hasattr(msg_chain, 'chain') and msg_chain.chain:
-                            # 手动提取文本
-                            text_parts = []
-                            for component in msg_chain.chain:
-                                if hasattr(component, 'text'):
-                                    text_parts.append(component.text)
-                                elif hasattr(component, 'content'):
-                                    text_parts.append(component.content)
-                            text = ''.join(text_parts) if text_parts else None
-                        
+            # 使用指令执行器执行指令，并发已满时告知LLM稍后重试
+            try:
+                if plan.stream:
+                    # 流式执行：每条响应捕获后立即转发，文本随之累积
+                    captured_count = 0
+                    response_texts = []
+                    async for text in self._stream_and_forward(plan, unified_msg_origin, args, creator_id, creator_name):
+                        captured_count += 1
                         if text:
                             response_texts.append(text)
-                
-                if response_texts:
-                    return f"指令 '{command_text}' 执行结果：\n" + "\n".join(response_texts)
+                    success = captured_count > 0
                 else:
-                    return f"指令 '{command_text}' 执行成功，但未返回文本内容"
-            else:
+                    success, captured_messages = await self.command_executor.execute_command(
+                        unified_msg_origin, plan.build_command(args), creator_id, creator_name, plan.capture_policy,
+                        plan.dedup_scope, command_text, plan.max_concurrency, plan.dispatch_mode
+                    )
+                    success = success and bool(captured_messages)
+            except AdmissionRejected as e:
+                return f"指令 '{command_text}' 未执行：{e}"
+            
+            if not success:
                 return f"指令 '{command_text}' 执行失败或超时"
+            
+            if not plan.stream:
+                # 主动发送转发消息（类似旧插件的机制），连续的纯文本消息合并后按平台限速发送
+                forward_messages = self.send_scheduler.merge(
+                    unified_msg_origin, [msg for msg in captured_messages if msg is not None])
+                tracer.debug("开始主动发送转发消息，共 %d 条", len(forward_messages))
+                
+                for captured_msg in forward_messages:
+                    await self._forward(plan, unified_msg_origin, captured_msg)
+                
+                # 提取响应文本用于返回给LLM函数
+                response_texts = [text for text in map(self.text_extractor.extract, captured_messages) if text]
+            
+            if response_texts:
+                result = f"指令 '{command_text}' 执行结果：\n" + self.text_extractor.truncate("\n".join(response_texts))
+            else:
+                result = f"指令 '{command_text}' 执行成功，但未返回文本内容"
+            
+            if plan.cache_ttl > 0:
+                self.result_cache.put(cache_key, result, plan.cache_ttl)
+            return result
                 
         except Exception as e:
             logger.error(f"执行指令失败: {e}")
             return f"执行指令时发生错误：{str(e)}"
+        finally:
+            tracer.end(trace)
+
+    async def _stream_and_forward(self, plan: ExecutionPlan, unified_msg_origin: str, args: str,
+                                  creator_id: str, creator_name: str = None) -> AsyncIterator[Optional[str]]:
+        """逐条转发捕获到的响应，并产出每条响应的文本（无文本时为None）"""
+        async for captured_msg in self.command_executor.stream_command(
+            unified_msg_origin, plan.build_command(args), creator_id, creator_name, plan.capture_policy,
+            plan.command_name, plan.max_concurrency, plan.dispatch_mode
+        ):
+            if captured_msg is None:
+                continue
+            await self._forward(plan, unified_msg_origin, captured_msg)
+            yield self.text_extractor.extract(captured_msg)
+
+    async def _forward(self, plan: ExecutionPlan, unified_msg_origin: str, captured_msg):
+        """把捕获到的消息加上前缀转发到会话，同一会话的消息保持顺序"""
+        # 构建转发消息：预编译的前缀 + 捕获到的消息内容
+        forward_msg = MessageChain()
+        forward_msg.chain.extend(plan.forward_prefix)
+        if hasattr(captured_msg, 'chain') and captured_msg.chain:
+            forward_msg.chain.extend(captured_msg.chain)
+        
+        # 后台转发时提交后立即返回，结果文本无需等待平台发送
+        if self.async_forward:
+            self.forward_outbox.submit(unified_msg_origin, forward_msg, plan.command_name)
+        else:
+            send_started = time.monotonic()
+            await self.send_scheduler.send(unified_msg_origin, forward_msg)
+            self.metrics.observe(plan.command_name, "forward", (time.monotonic() - send_started) * 1000)
+
+    def default_item_timeout(self, command_text: str) -> float:
+        """批量执行中单条指令的默认时限：等待执行许可与捕获的最长时间之和再留出余量
+        
+        时限不能恰好等于两者之和，否则排队的指令会在捕获即将结束时被取消。
+        """
+        plan = self.get_plan(command_text)
+        capture_timeout = (plan.capture_policy.timeout if plan is not None
+                           else float(self.config.get("capture_timeout", 20.0)))
+        admission = self.command_executor.command_trigger.admission
+        return admission.wait_timeout + capture_timeout + self.ITEM_TIMEOUT_MARGIN
+
+    async def execute_commands(self, event, items: List[Dict[str, str]], item_timeout: float = 0) -> List[str]:
+        """并发执行多条指令，每条单独限时，结果按输入顺序返回
+        
+        Args:
+            items: 指令列表，每项包含 command（指令名）和 args（参数）
+            item_timeout: 单条指令的最长执行时间（秒），0 为按指令的等待与捕获时间自动计算
+        """
+        async def run_one(item: Dict[str, str]) -> str:
+            command_text = item["command"]
+            timeout = item_timeout if item_timeout > 0 else self.default_item_timeout(command_text)
+            try:
+                return await asyncio.wait_for(self.execute_command(event, command_text, item.get("args", "")),
+                                              timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"批量执行中的指令 {command_text} 超过 {timeout:g} 秒未完成")
+                return f"指令 '{command_text}' 执行超过 {timeout:g} 秒，已放弃等待"
+        
+        return list(await asyncio.gather(*(run_one(item) for item in items)))
 
 
 
@@ -116,10 +200,10 @@ class CommandProcessor:
             logger.info(f"[command_processor] data_manager.add_mapping 返回: success={success}, message='{message}'")
             
             if success:
-                logger.info(f"[command_processor] 开始刷新动态LLM函数")
-                # 刷新动态LLM函数
-                self.star.dynamic_llm_manager.refresh_functions()
-                logger.info(f"[command_processor] 动态LLM函数刷新完成")
+                logger.info(f"[command_processor] 开始同步动态LLM函数")
+                # 增量同步该映射对应的动态LLM函数
+                self.star.dynamic_llm_manager.sync_mapping(command_name)
+                logger.info(f"[command_processor] 动态LLM函数同步完成")
             
             yield event.plain_result(message)
             
@@ -151,16 +235,116 @@ class CommandProcessor:
             logger.error(f"列出指令映射失败: {e}")
             yield event.plain_result(f"列出指令映射时发生错误：{str(e)}")
 
+    async def set_mapping_option(self, event, command_name: str, key: str, value: str):
+        """设置指令映射选项"""
+        try:
+            success, message = self.data_manager.set_mapping_option(command_name, key, value)
+            if success:
+                self.result_cache.invalidate(command_name)
+            yield event.plain_result(message if success else f"错误：{message}")
+        except Exception as e:
+            logger.error(f"设置指令映射选项失败: {e}")
+            yield event.plain_result(f"设置指令映射选项时发生错误：{str(e)}")
+
+    async def import_mappings(self, event, payload: str, overwrite: bool = False):
+        """批量导入指令映射，只保存和同步一次"""
+        try:
+            if not payload.strip():
+                yield event.plain_result("错误：请在指令后附上 JSON、YAML 或 CSV 格式的映射数据")
+                return
+            
+            items, errors = MappingSerializer.loads(payload)
+            if errors:
+                yield event.plain_result("导入失败：\n" + "\n".join(errors[:10]))
+                return
+            
+            success, message, changed = self.data_manager.import_mappings(items, overwrite)
+            if success and changed:
+                for command_name in changed:
+                    self.result_cache.invalidate(command_name)
+                self.star.dynamic_llm_manager.sync_mappings(changed)
+            yield event.plain_result(message)
+        except Exception as e:
+            logger.error(f"批量导入指令映射失败: {e}")
+            yield event.plain_result(f"批量导入指令映射时发生错误：{str(e)}")
+
+    async def export_mappings(self, event, fmt: str = "json"):
+        """批量导出指令映射"""
+        try:
+            if fmt not in MappingSerializer.FORMATS:
+                yield event.plain_result(f"错误：不支持的格式 '{fmt}'，可用格式：{', '.join(MappingSerializer.FORMATS)}")
+                return
+            
+            mappings = self.data_manager.list_mappings()
+            if not mappings:
+                yield event.plain_result("当前没有配置任何指令映射")
+                return
+            
+            yield event.plain_result(MappingSerializer.dumps(mappings, fmt))
+        except Exception as e:
+            logger.error(f"批量导出指令映射失败: {e}")
+            yield event.plain_result(f"批量导出指令映射时发生错误：{str(e)}")
+
+    async def clear_cache(self, event, command_name: str = None):
+        """清除结果缓存，不指定指令时清空全部"""
+        count = self.result_cache.invalidate(command_name)
+        target = f"指令 '{command_name}' 的" if command_name else "全部"
+        yield event.plain_result(f"已清除{target}结果缓存，共 {count} 条")
+
+    async def show_cache_stats(self, event):
+        """显示结果缓存统计"""
+        stats = self.result_cache.stats()
+        yield event.plain_result(
+            f"结果缓存：{stats['size']}/{stats['max_size']} 条，"
+            f"命中 {stats['hits']} 次，未命中 {stats['misses']} 次，命中率 {stats['hit_rate']:.1%}"
+        )
+
+    async def show_queue_stats(self, event):
+        """显示指令执行并发与等待队列状态"""
+        admission = self.command_executor.command_trigger.admission
+        stats = admission.snapshot()
+        sender = self.send_scheduler.snapshot()
+        outbox = self.forward_outbox.snapshot()
+        yield event.plain_result(
+            f"指令执行队列：执行中 {stats['in_flight']}（上限 {admission.max_concurrency or '不限'}），"
+            f"等待中 {stats['waiting']}（上限 {admission.max_waiting}，峰值 {stats['peak_waiting']}）\n"
+            f"活跃会话 {stats['active_sessions']}，活跃映射 {stats['active_mappings']}\n"
+            f"累计放行 {stats['admitted']}，拒绝 {stats['rejected']}（其中等待超时 {stats['timed_out']}）\n"
+            f"消息转发：已发送 {sender['sent']} 条，合并 {sender['merged']} 条，限速等待 {sender['throttled']} 次\n"
+            f"后台转发：待发送 {outbox['pending']} 条（{outbox['sessions']} 个会话），"
+            f"丢弃 {outbox['dropped']} 条，失败 {outbox['failed']} 条"
+        )
+
     async def remove_mapping(self, event, command_name: str):
         """删除指令映射"""
         try:
             success = self.data_manager.remove_mapping(command_name)
             if success:
-                # 刷新动态LLM函数
-                self.star.dynamic_llm_manager.refresh_functions()
+                self.result_cache.invalidate(command_name)
+                # 增量同步该映射对应的动态LLM函数
+                self.star.dynamic_llm_manager.sync_mapping(command_name)
                 yield event.plain_result(f"成功删除指令映射：'{command_name}'")
             else:
                 yield event.plain_result(f"错误：指令 '{command_name}' 不存在映射")
         except Exception as e:
             logger.error(f"删除指令映射失败: {e}")
-            yield event.plain_result(f"删除指令映射时发生错误：{str(e)}") 
\ No newline at end of file
+            yield event.plain_result(f"删除指令映射时发生错误：{str(e)}")
+
+    async def show_stats(self, event, command_name: str = None):
+        """显示按映射统计的执行指标，不指定指令时列出最慢的映射"""
+        lines = self.metrics.summary(command_name)
+        if not lines:
+            target = f"指令 '{command_name}' " if command_name else ""
+            yield event.plain_result(f"{target}暂无执行指标")
+            return
+        yield event.plain_result("执行指标（按捕获总耗时 p95 排序）：\n" + "\n".join(lines))
+
+    async def reset_stats(self, event):
+        """清空执行指标"""
+        self.metrics.reset()
+        yield event.plain_result("已清空执行指标")
+
+    async def close(self):
+        """插件卸载时把后台转发队列中的消息发送完，并最后导出一次指标"""
+        await self.forward_outbox.drain()
+        await self.metrics.stop_export(self.metrics_file)
@@ -1,129 +1,244 @@
+import time
 import asyncio
+from typing import AsyncIterator
 from astrbot.api import logger
 from astrbot.api.message_components import Plain
 from astrbot.core.platform.astr_message_event import AstrMessageEvent
 from astrbot.core.message.message_event_result import MessageChain
 from .event_factory import EventFactory
+from .message_ids import message_ids
+from .capture_session import CaptureSession, CapturePolicy
+from .admission import AdmissionController, AdmissionRejected
+from .direct_dispatch import DirectDispatcher
+from .send_scheduler import SendScheduler
+from .metrics import Metrics
+from .tracing import tracer
 
 
 class CommandTrigger:
     """指令触发器，用于触发其他插件指令并捕获结果"""
     
-    def __init__(self, context):
+    # 执行方式
+    DISPATCH_QUEUE = "queue"  # 提交到全局事件队列，经过完整流水线
+    DISPATCH_DIRECT = "direct"  # 直接调用目标指令的处理函数，无法解析时回退到事件队列
+    
+    def __init__(self, context, config=None):
         self.context = context
-        self.captured_messages = []  # 存储捕获到的消息
-        self.original_send_method = None  # 保存原始的send方法
-        self.target_event = None  # 目标事件对象
+        self.sessions = {}  # 进行中的捕获会话，按伪造事件的消息ID索引
         self.event_factory = EventFactory(context)  # 事件工厂
+        self.admission = AdmissionController.from_config(config)  # 准入控制
+        self.dispatcher = DirectDispatcher(context)  # 直接调用处理函数
+        self.direct_tasks = set()  # 运行中的直接调用任务，持有引用防止被回收
+        self.send_scheduler = SendScheduler.from_config(context, config)  # 按平台限速发送
+        self.metrics = Metrics()  # 按映射统计的执行指标
         
-    def setup_message_interceptor(self, target_event):
-        """设置消息拦截器来捕获指令的响应"""
-        self.target_event = target_event
-        self.captured_messages = []
-        
-        # 保存原始的send方法
-        if self.original_send_method is None:
-            self.original_send_method = target_event.send
-        
-        # 创建拦截器包装函数
-        async def intercepted_send(message_chain):
-            # 捕获这条消息
-            if message_chain is not None and hasattr(message_chain, 'chain'):
-                logger.info(f"捕获到指令响应消息，包含 {len(message_chain.chain)} 个组件")
-                self.captured_messages.append(message_chain)
-            else:
-                logger.info(f"捕获到指令响应消息，但消息为空或格式不正确")
-                # 即使消息为空，也记录为已捕获
-                if message_chain is not None:
-                    self.captured_messages.append(message_chain)
-            
-            # 设置已发送标记，但不实际发送到平台
-            target_event._has_send_oper = True
-            return True
-        
-        # 替换事件的send方法
-        target_event.send = intercepted_send
-        logger.info(f"已设置消息拦截器，监听事件: {target_event.unified_msg_origin}")
+    def setup_message_interceptor(self, target_event) -> CaptureSession:
+        """为目标事件创建独立的捕获会话并设置消息拦截器"""
+        session = CaptureSession(target_event)
+        session.install()
+        self.sessions[session.message_id] = session
+        return session
+    
+    def restore_message_sender(self, session: CaptureSession):
+        """恢复原始的消息发送器并结束捕获会话"""
+        session.restore()
+        self.sessions.pop(session.message_id, None)
     
-    def restore_message_sender(self):
-        """恢复原始的消息发送器"""
-        if self.original_send_method and self.target_event:
-            self.target_event.send = self.original_send_method
-            logger.info("已恢复原始消息发送器")
+    def get_session(self, message_id: str):
+        """按伪造事件的消息ID获取进行中的捕获会话，用于把响应关联回触发它的调用
+        
+        不是本插件生成的消息ID（如真实用户消息）直接返回None。
+        """
+        if not message_ids.owns(message_id):
+            return None
+        return self.sessions.get(message_id)
     
     def create_command_event(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None) -> AstrMessageEvent:
         """创建指令事件对象"""
         return self.event_factory.create_event(unified_msg_origin, command, creator_id, creator_name)
     
-    async def trigger_and_capture_command(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None):
-        """触发指令并捕获响应"""
+    async def trigger_and_capture_command(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None,
+                                          policy: CapturePolicy = None, mapping_key: str = None, mapping_limit: int = None,
+                                          dispatch_mode: str = DISPATCH_QUEUE):
+        """触发指令并捕获响应
+        
+        Args:
+            policy: 捕获策略，默认捕获到第一条消息即返回
+            mapping_key: 映射标识，用于按映射限制并发，默认使用指令本身
+            mapping_limit: 该映射的并发上限，为空时使用全局配置
+            dispatch_mode: 执行方式，direct 时按 mapping_key 解析处理函数并直接调用
+        
+        Raises:
+            AdmissionRejected: 并发已满且无法在等待时间内获得执行许可
+        """
+        policy = policy or CapturePolicy()
+        mapping_key = mapping_key or command
+        
+        # 获取执行许可，失败时直接抛出让调用方告知LLM
+        await self._acquire(unified_msg_origin, mapping_key, mapping_limit)
         try:
-            logger.info(f"开始触发指令: {command}")
-            
-            # 创建指令事件
-            fake_event = self.create_command_event(unified_msg_origin, command, creator_id, creator_name)
-            
-            # 设置消息拦截器
-            self.setup_message_interceptor(fake_event)
-            
-            # 提交事件到事件队列
-            event_queue = self.context.get_event_queue()
-            event_queue.put_nowait(fake_event)
-            
-            logger.info(f"已将指令事件 {command} 提交到事件队列")
-            
-            # 等待指令执行并捕获响应
-            max_wait_time = 20.0  # 最大等待20秒
-            wait_interval = 0.1   # 每100毫秒检查一次
-            waited_time = 0.0
-            
-            while waited_time < max_wait_time:
-                await asyncio.sleep(wait_interval)
-                waited_time += wait_interval
-                
-                # 检查是否捕获到了消息
-                if self.captured_messages:
-                    logger.info(f"成功捕获到 {len(self.captured_messages)} 条响应消息")
-                    break
+            return await self._trigger_and_capture(unified_msg_origin, command, creator_id, creator_name, policy,
+                                                   mapping_key, dispatch_mode == self.DISPATCH_DIRECT)
+        finally:
+            await self.admission.release(unified_msg_origin, mapping_key)
+    
+    async def _acquire(self, unified_msg_origin: str, mapping_key: str, mapping_limit: int = None):
+        """获取执行许可并记录等待时间与拒绝次数"""
+        wait_started = time.monotonic()
+        try:
+            await self.admission.acquire(unified_msg_origin, mapping_key, mapping_limit)
+        except AdmissionRejected:
+            self.metrics.incr(mapping_key, "rejected")
+            raise
+        self.metrics.observe(mapping_key, "admission_wait", (time.monotonic() - wait_started) * 1000)
+    
+    def _record_capture(self, mapping_key: str, session: CaptureSession):
+        """记录捕获结果与耗时"""
+        if session.captured_messages:
+            self.metrics.incr(mapping_key, "success")
+            self.metrics.observe(mapping_key, "first_response", session.first_response_ms())
+        elif session.finished:
+            # 流水线已结束但指令没有输出，不算超时
+            self.metrics.incr(mapping_key, "empty")
+        else:
+            self.metrics.incr(mapping_key, "timeouts")
+        self.metrics.observe(mapping_key, "capture_total", session.elapsed_ms())
+    
+    async def _trigger_and_capture(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str,
+                                   policy: CapturePolicy, mapping_key: str, direct: bool = False):
+        """提交伪造事件并按策略捕获响应
+        
+        Args:
+            mapping_key: 映射标识，用于记录指标和解析直接调用的处理函数
+            direct: 是否直接调用处理函数，否则提交到事件队列
+        """
+        session = None
+        try:
+            session = self._start_session(unified_msg_origin, command, creator_id, creator_name, mapping_key, direct)
             
-            # 恢复原始消息发送器
-            self.restore_message_sender()
+            # 按捕获策略等待响应，由拦截器发出信号，无需轮询
+            await session.wait(policy)
+            self._record_capture(mapping_key, session)
             
-            if self.captured_messages:
-                return True, self.captured_messages
+            if session.captured_messages:
+                tracer.info("成功捕获到 %d 条响应消息 (%s)，首条响应 %.0f ms，总耗时 %.0f ms",
+                            len(session.captured_messages), session.message_id,
+                            session.first_response_ms(), session.elapsed_ms())
+                return True, list(session.captured_messages)
             else:
-                logger.warning(f"等待 {max_wait_time} 秒后未捕获到指令 {command} 的响应消息")
+                logger.warning(f"在 {policy.timeout} 秒内未捕获到指令 {command} 的响应消息")
                 return False, []
             
+        except asyncio.CancelledError:
+            # 调用方等待超时或被取消，按超时计入指标
+            if session is not None:
+                self.metrics.incr(mapping_key, "timeouts")
+                self.metrics.observe(mapping_key, "capture_total", session.elapsed_ms())
+            raise
         except Exception as e:
             logger.error(f"触发指令失败: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
-            
-            # 确保恢复原始消息发送器
-            self.restore_message_sender()
+            self.metrics.incr(mapping_key, "errors")
             return False, []
+        finally:
+            # 唯一的恢复点：正常结束、出错和被取消时都在这里恢复原始消息发送器并移除捕获会话
+            if session is not None:
+                self.restore_message_sender(session)
+    
+    def _start_session(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str,
+                       mapping_key: str, direct: bool = False) -> CaptureSession:
+        """创建伪造事件与捕获会话，并提交执行"""
+        tracer.debug("开始触发指令: %s", command)
+        
+        # 创建指令事件
+        build_started = time.monotonic()
+        fake_event = self.create_command_event(unified_msg_origin, command, creator_id, creator_name)
+        self.metrics.observe(mapping_key, "event_build", (time.monotonic() - build_started) * 1000)
+        
+        # 设置消息拦截器，每次调用使用独立的捕获会话
+        session = self.setup_message_interceptor(fake_event)
+        
+        # 优先直接调用处理函数，否则提交事件到事件队列
+        try:
+            if direct and self._dispatch_direct(mapping_key, fake_event, session):
+                tracer.debug("已直接调用指令 %s 的处理函数", command)
+            else:
+                event_queue = self.context.get_event_queue()
+                event_queue.put_nowait(fake_event)
+                tracer.debug("已将指令事件 %s 提交到事件队列", command)
+        except Exception:
+            self.restore_message_sender(session)
+            raise
+        return session
     
-    async def trigger_and_forward_command(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None):
+    async def trigger_and_stream_command(self, unified_msg_origin: str, command: str, creator_id: str,
+                                         creator_name: str = None, policy: CapturePolicy = None,
+                                         mapping_key: str = None, mapping_limit: int = None,
+                                         dispatch_mode: str = DISPATCH_QUEUE) -> AsyncIterator[MessageChain]:
+        """触发指令并逐条产出捕获到的响应，参数与 trigger_and_capture_command 相同
+        
+        每条响应捕获后立即产出，不等待捕获结束；调用方提前停止迭代时捕获随之结束。
+        
+        Raises:
+            AdmissionRejected: 并发已满且无法在等待时间内获得执行许可
+        """
+        policy = policy or CapturePolicy()
+        mapping_key = mapping_key or command
+        
+        await self._acquire(unified_msg_origin, mapping_key, mapping_limit)
+        session = None
+        try:
+            session = self._start_session(unified_msg_origin, command, creator_id, creator_name,
+                                          mapping_key, dispatch_mode == self.DISPATCH_DIRECT)
+            async for message_chain in session.stream(policy):
+                yield message_chain
+            self._record_capture(mapping_key, session)
+            tracer.info("流式捕获结束 (%s)，共 %d 条响应，总耗时 %.0f ms",
+                        session.message_id, len(session.captured_messages), session.elapsed_ms())
+        except Exception:
+            self.metrics.incr(mapping_key, "errors")
+            raise
+        finally:
+            if session is not None:
+                self.restore_message_sender(session)
+            await self.admission.release(unified_msg_origin, mapping_key)
+    
+    def _dispatch_direct(self, command_name: str, fake_event, session: CaptureSession) -> bool:
+        """在后台直接运行指令的处理函数，无法直接调用时返回False
+        
+        消息拦截器仍然保留，处理函数自行调用 event.send 发送的消息同样会被捕获。
+        """
+        handler_md = self.dispatcher.resolve(command_name)
+        if handler_md is None:
+            return False
+        
+        params = self.dispatcher.prepare(handler_md, fake_event)
+        if params is None:
+            return False
+        
+        task = asyncio.create_task(self.dispatcher.dispatch(handler_md, fake_event, params, session))
+        self.direct_tasks.add(task)
+        task.add_done_callback(self.direct_tasks.discard)
+        return True
+    
+    async def trigger_and_forward_command(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None,
+                                          policy: CapturePolicy = None):
         """触发指令并转发结果"""
         # 触发指令并捕获响应
-        success, captured_messages = await self.trigger_and_capture_command(
-            unified_msg_origin, command, creator_id, creator_name
-        )
+        try:
+            success, captured_messages = await self.trigger_and_capture_command(
+                unified_msg_origin, command, creator_id, creator_name, policy
+            )
+        except AdmissionRejected as e:
+            logger.warning(f"指令 {command} 被准入控制拒绝: {e}")
+            success, captured_messages = False, []
         
         if success and captured_messages:
-            logger.info(f"成功捕获到指令 {command} 的 {len(captured_messages)} 条响应，开始转发")
+            tracer.debug("成功捕获到指令 %s 的 %d 条响应，开始转发", command, len(captured_messages))
             
-            # 转发捕获到的消息
-            for i, captured_msg in enumerate(captured_messages):
-                logger.info(f"转发第 {i+1} 条消息，包含 {len(captured_msg.chain)} 个组件")
-                
-                # 发送捕获到的消息
-                await self.context.send_message(unified_msg_origin, captured_msg)
-                
-                # 如果有多条消息，添加间隔
-                if len(captured_messages) > 1 and i < len(captured_messages) - 1:
-                    await asyncio.sleep(0.5)
+            # 按平台限速转发捕获到的消息
+            await self.send_scheduler.send_all(unified_msg_origin, captured_messages)
         else:
             logger.warning(f"未能捕获到指令 {command} 的响应")
             
@@ -1,41 +1,150 @@
-import os
-import json
+import asyncio
 import datetime
-from typing import Dict, Tuple
+from typing import Dict, List, Optional, Tuple
 from astrbot.api.star import Context, StarTools
 from astrbot.api import logger
 from .utils import CommandUtils
+from .mapping_store import MappingStore, create_mapping_store
+from .scope_index import ScopeIndex
 
 class DataManager:
-    def __init__(self, context: Context):
+    # 变更后等待多久再写盘，期间的连续变更合并为一次写入
+    SAVE_DEBOUNCE_SECONDS = 0.5
+
+    def __init__(self, context: Context, config=None):
         self.context = context
+        config = config or {}
+        self._dirty = False  # 是否有未写盘的变更
+        self._changed = set()  # 未写盘的变更涉及的指令名，用于增量写入
+        self._save_task = None  # 等待中的防抖写盘任务
+        self._flush_lock = asyncio.Lock()
         
         # 使用框架提供的 StarTools.get_data_dir() 获取插件专属数据目录
         # 显式指定插件名称，避免自动检测失败
-        plugin_data_dir = StarTools.get_data_dir("command_to_llm")
-        self.data_file = plugin_data_dir / "command_mappings.json"
+        self.data_dir = StarTools.get_data_dir("command_to_llm")
+        self.store: MappingStore = create_mapping_store(str(config.get("storage_backend", "json")).lower(),
+                                                        self.data_dir)
         
         # 加载指令映射配置
         self.command_mappings = self.load_command_mappings()
+        # LLM函数名 -> 使用该函数名的指令（按加入顺序）
+        self._function_index: Dict[str, Dict[str, None]] = {}
+        # 设置了可用范围的映射
+        self.scopes = ScopeIndex()
+        for command_name, mapping in self.command_mappings.items():
+            self._index(command_name, mapping)
+            self.scopes.update(command_name, mapping)
 
     def load_command_mappings(self) -> Dict[str, Dict]:
         """加载指令映射配置"""
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"加载指令映射配置失败: {e}")
-                return {}
-        return {}
+        return self.store.load()
+
+    def _index(self, command_name: str, mapping: Dict):
+        self._function_index.setdefault(mapping.get("llm_function", ""), {})[command_name] = None
+
+    def _unindex(self, command_name: str, mapping: Dict):
+        function = mapping.get("llm_function", "")
+        commands = self._function_index.get(function)
+        if commands is not None:
+            commands.pop(command_name, None)
+            if not commands:
+                del self._function_index[function]
+
+    def _put(self, command_name: str, mapping: Dict):
+        """写入映射并维护函数名索引，映射对象整体替换而不是原地修改"""
+        old = self.command_mappings.get(command_name)
+        self.command_mappings[command_name] = mapping
+        # 函数名不变时保留索引中的顺序
+        if old is None or old.get("llm_function", "") != mapping.get("llm_function", ""):
+            if old is not None:
+                self._unindex(command_name, old)
+            self._index(command_name, mapping)
+        self.scopes.update(command_name, mapping)
+        self._changed.add(command_name)
+
+    def _discard(self, command_name: str):
+        """删除映射并维护函数名索引"""
+        old = self.command_mappings.pop(command_name)
+        self._unindex(command_name, old)
+        self.scopes.remove(command_name)
+        self._changed.add(command_name)
 
     def save_command_mappings(self):
-        """保存指令映射配置"""
+        """保存指令映射配置
+        
+        在事件循环中调用时仅标记变更并调度一次防抖写盘，写盘在线程池中执行；
+        没有运行中的事件循环时直接同步写入。
+        """
+        self._dirty = True
         try:
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.command_mappings, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"保存指令映射配置失败: {e}")
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            write, payload, changed = self._take_pending()
+            if not write(payload):
+                self._restore_pending(changed)
+            return
+        
+        if self._save_task is None or self._save_task.done():
+            self._save_task = loop.create_task(self._debounced_flush())
+
+    async def _debounced_flush(self):
+        """等待防抖时间后写盘，写盘期间又有新的变更时再写一轮"""
+        while self._dirty:
+            await asyncio.sleep(self.SAVE_DEBOUNCE_SECONDS)
+            if not await self.flush():
+                # 写盘失败时不在此重试，等待下一次保存或关闭时再写
+                return
+
+    async def flush(self) -> bool:
+        """立即将未保存的变更写入磁盘，返回是否成功（没有变更时也为True）"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return True
+            write, payload, changed = self._take_pending()
+            loop = asyncio.get_running_loop()
+            write_future = loop.run_in_executor(None, write, payload)
+            try:
+                ok = await asyncio.shield(write_future)
+            except asyncio.CancelledError:
+                # 线程中的写入无法中断，持有锁等它写完，避免旧快照在之后的写入完成后才落盘
+                ok = await write_future
+                raise
+            finally:
+                if not ok:
+                    # 写盘失败时保留脏标记，等待下一次保存或关闭时重试
+                    self._restore_pending(changed)
+            return ok
+
+    async def close(self):
+        """插件关闭时取消等待中的写盘任务，立即写入并关闭存储
+        
+        已经开始的写入不会被中断，最后一次写入在它完成之后进行。
+        """
+        if self._save_task is not None and not self._save_task.done():
+            self._save_task.cancel()
+        await self.flush()
+        self.store.close()
+
+    def _take_pending(self):
+        """取出待写入的变更，在事件循环中复制映射，避免写盘线程读取到正在修改的数据
+        
+        Returns:
+            (write, payload, changed): 写入函数、写入内容和涉及的指令名
+        """
+        self._dirty = False
+        changed, self._changed = self._changed, set()
+        if self.store.incremental:
+            payload = {}
+            for command_name in changed:
+                mapping = self.command_mappings.get(command_name)
+                payload[command_name] = dict(mapping) if mapping is not None else None
+            return self.store.apply, payload, changed
+        snapshot = {name: dict(mapping) for name, mapping in self.command_mappings.items()}
+        return self.store.save_all, snapshot, changed
+
+    def _restore_pending(self, changed: set):
+        self._dirty = True
+        self._changed |= changed
 
     def add_mapping(self, command_name: str, llm_function: str, description: str = "") -> Tuple[bool, str]:
         """添加指令映射
@@ -56,30 +165,131 @@ class DataManager:
             return False, f"指令 '{command_name}' 已存在映射"
         
         logger.info(f"[data_manager] 开始添加映射")
-        self.command_mappings[command_name] = {
+        self._put(command_name, {
             "llm_function": llm_function,
             "description": description,
             "created_at": str(datetime.datetime.now())
-        }
+        })
         
         logger.info(f"[data_manager] 保存映射配置")
         self.save_command_mappings()
         logger.info(f"[data_manager] 映射添加完成")
         return True, f"成功添加指令映射：'{command_name}' -> '{llm_function}'"
 
+    def import_mappings(self, items: List[Dict], overwrite: bool = False) -> Tuple[bool, str, List[str]]:
+        """批量导入指令映射
+        
+        先一次性校验全部条目，有任何错误则整体放弃；通过后统一写入并只保存一次。
+        
+        Args:
+            items: 映射条目列表，每项包含 command、llm_function，可选 description 及映射选项
+            overwrite: 是否覆盖已存在的映射，否则跳过
+            
+        Returns:
+            (success, message, changed): 成功状态、消息和实际写入的指令名列表
+        """
+        errors = []
+        prepared = {}
+        now = str(datetime.datetime.now())
+        
+        for i, item in enumerate(items, 1):
+            command_name = str(item.get("command", "")).replace("--", " ").strip()
+            llm_function = str(item.get("llm_function", "")).strip()
+            item_errors = CommandUtils.validate_mapping(command_name, llm_function)
+            
+            mapping = {
+                "llm_function": llm_function,
+                "description": str(item.get("description", "") or ""),
+                "created_at": str(item.get("created_at") or now),
+            }
+            for key, value in item.items():
+                if key in CommandUtils.MAPPING_OPTIONS:
+                    parsed, option_errors = CommandUtils.parse_mapping_option(key, value)
+                    item_errors.extend(option_errors)
+                    mapping[key] = parsed
+            
+            if command_name in prepared:
+                item_errors.append(f"指令 '{command_name}' 重复")
+            if item_errors:
+                errors.append(f"第 {i} 项: {'; '.join(item_errors)}")
+            else:
+                prepared[command_name] = mapping
+        
+        if errors:
+            shown = errors[:10]
+            if len(errors) > len(shown):
+                shown.append(f"……共 {len(errors)} 处错误")
+            return False, "导入失败，数据校验未通过：\n" + "\n".join(shown), []
+        
+        changed = []
+        skipped = 0
+        for command_name, mapping in prepared.items():
+            if command_name in self.command_mappings and not overwrite:
+                skipped += 1
+                continue
+            self._put(command_name, mapping)
+            changed.append(command_name)
+        
+        if changed:
+            self.save_command_mappings()
+        
+        logger.info(f"[data_manager] 批量导入完成，写入 {len(changed)} 条，跳过 {skipped} 条")
+        message = f"导入完成：写入 {len(changed)} 条映射"
+        if skipped:
+            message += f"，跳过已存在的 {skipped} 条（使用 overwrite 覆盖）"
+        return True, message, changed
+
     def remove_mapping(self, command_name: str) -> bool:
         """删除指令映射"""
         if command_name not in self.command_mappings:
             return False
         
-        del self.command_mappings[command_name]
+        self._discard(command_name)
         self.save_command_mappings()
         return True
 
+    def set_mapping_option(self, command_name: str, key: str, value: str) -> Tuple[bool, str]:
+        """设置指令映射的单项选项，值为 default 时恢复使用全局配置
+        
+        Returns:
+            (success, message): 成功状态和消息
+        """
+        mapping = self.command_mappings.get(command_name)
+        if mapping is None:
+            return False, f"指令 '{command_name}' 不存在映射"
+        
+        # 生成新的映射对象而不是原地修改，便于依赖映射对象的缓存感知变更
+        new_mapping = dict(mapping)
+        if value == "default" and key in CommandUtils.MAPPING_OPTIONS:
+            new_mapping.pop(key, None)
+            message = f"指令 '{command_name}' 的选项 {key} 已恢复为全局配置"
+        else:
+            parsed, errors = CommandUtils.parse_mapping_option(key, value)
+            if errors:
+                return False, f"参数验证失败: {'; '.join(errors)}"
+            new_mapping[key] = parsed
+            message = f"已设置指令 '{command_name}' 的选项 {key} = {parsed}"
+        
+        self._put(command_name, new_mapping)
+        self.save_command_mappings()
+        return True, message
+
     def get_mapping(self, command_name: str) -> Dict:
         """获取指令映射"""
         return self.command_mappings.get(command_name, {})
 
+    def get_mapping_by_function(self, llm_function: str) -> Tuple[Optional[str], Dict]:
+        """按LLM函数名查找映射，多个映射使用同名函数时返回最早加入的一个
+        
+        Returns:
+            (command_name, mapping): 指令名和映射，不存在时为 (None, {})
+        """
+        commands = self._function_index.get(llm_function)
+        if not commands:
+            return None, {}
+        command_name = next(iter(commands))
+        return command_name, self.command_mappings[command_name]
+
     def list_mappings(self) -> Dict[str, Dict]:
         """列出所有指令映射"""
         return self.command_mappings.copy() 
\ No newline at end of file
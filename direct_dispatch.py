@@ -0,0 +1,126 @@
+import inspect
+from typing import Dict, Optional, Tuple
+from astrbot.api import logger
+from astrbot.core.star.star_handler import star_handlers_registry, EventType
+from .capture_session import CaptureSession
+from .tracing import tracer
+
+
+class DirectDispatcher:
+    """直接调用目标指令处理函数，不经过全局事件队列
+
+    从插件处理函数注册表中解析出指令对应的处理函数并缓存，执行时只运行该处理函数
+    自身的过滤器（指令解析、权限等），跳过唤醒检查和其他插件的处理函数。
+    无法解析或过滤器未通过时由调用方回退到事件队列。
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self._handlers: Dict[str, Optional[object]] = {}  # 指令名 -> 处理函数元数据，未找到时为None
+        self._registry_size = -1  # 解析时的注册表大小，插件增减后缓存失效
+
+    def resolve(self, command_name: str):
+        """解析指令对应的处理函数，结果（包括未找到）按指令名缓存"""
+        size = len(star_handlers_registry)
+        if size != self._registry_size:
+            self._handlers.clear()
+            self._registry_size = size
+
+        if command_name in self._handlers:
+            handler_md = self._handlers[command_name]
+            # 插件重载后旧的元数据会被替换
+            if handler_md is None or star_handlers_registry.get_handler_by_full_name(handler_md.handler_full_name) is handler_md:
+                return handler_md
+
+        handler_md = self._find_handler(" ".join(command_name.lstrip("/").split()))
+        self._handlers[command_name] = handler_md
+        if handler_md is None:
+            logger.info(f"未找到指令 {command_name} 的处理函数，将使用事件队列执行")
+        else:
+            logger.info(f"指令 {command_name} 解析为处理函数 {handler_md.handler_full_name}")
+        return handler_md
+
+    def _find_handler(self, command_name: str):
+        """在消息事件处理函数中查找声明了该指令的处理函数"""
+        for handler_md in star_handlers_registry.get_handlers_by_event_type(EventType.AdapterMessageEvent):
+            for event_filter in handler_md.event_filters:
+                get_names = getattr(event_filter, "get_complete_command_names", None)
+                if get_names is None:
+                    continue
+                try:
+                    if command_name in get_names():
+                        return handler_md
+                except Exception as e:
+                    logger.warning(f"读取 {handler_md.handler_full_name} 的指令名失败: {e}")
+        return None
+
+    def invalidate(self):
+        """清空处理函数解析缓存"""
+        self._handlers.clear()
+        self._registry_size = -1
+
+    def prepare(self, handler_md, event) -> Optional[Dict]:
+        """按正常流水线的方式标记事件并运行处理函数自身的过滤器
+
+        Returns:
+            指令解析出的参数，过滤器未通过时返回None且事件保持原样
+        """
+        saved = self._save_state(event)
+        cfg = self.context.get_config()
+
+        # 流水线的唤醒阶段会去掉唤醒前缀并标记事件
+        event.message_str = event.message_str.lstrip("/").strip()
+        event.is_wake = True
+        event.is_at_or_wake_command = True
+        if str(event.get_sender_id()) in [str(admin) for admin in cfg.get("admins_id", [])]:
+            event.role = "admin"
+
+        try:
+            for event_filter in handler_md.event_filters:
+                if not event_filter.filter(event, cfg):
+                    tracer.debug("事件未通过 %s 的过滤器 %s", handler_md.handler_full_name, type(event_filter).__name__)
+                    self._restore_state(event, saved)
+                    return None
+        except Exception as e:
+            logger.warning(f"运行 {handler_md.handler_full_name} 的过滤器失败: {e}")
+            self._restore_state(event, saved)
+            return None
+
+        return event.get_extra("parsed_params") or {}
+
+    @staticmethod
+    def _save_state(event) -> Tuple:
+        return event.message_str, event.is_wake, event.is_at_or_wake_command, getattr(event, "role", "member")
+
+    @staticmethod
+    def _restore_state(event, saved: Tuple):
+        event.message_str, event.is_wake, event.is_at_or_wake_command, event.role = saved
+
+    async def dispatch(self, handler_md, event, params: Dict, session: CaptureSession):
+        """调用处理函数，把产出的结果记录到捕获会话，结束时标记会话完成"""
+        try:
+            ret = handler_md.handler(event, **params)
+            if inspect.isasyncgen(ret):
+                async for result in ret:
+                    self._collect(event, result, session)
+                    if event.is_stopped():
+                        break
+            elif inspect.isawaitable(ret):
+                self._collect(event, await ret, session)
+            else:
+                self._collect(event, ret, session)
+        except Exception as e:
+            logger.error(f"直接调用 {handler_md.handler_full_name} 失败: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+        finally:
+            session.mark_finished()
+
+    @staticmethod
+    def _collect(event, result, session: CaptureSession):
+        """记录处理函数产出的结果，产出为空时读取处理函数通过 set_result 设置的结果"""
+        if result is None:
+            result = event.get_result()
+            event.clear_result()
+        if result is not None and getattr(result, "chain", None):
+            session.capture(result)
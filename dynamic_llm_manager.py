@@ -1,69 +1,260 @@
-import asyncio
-from typing import Dict, List, Optional
+import copy
+import json
+from typing import Dict, List, Optional, Tuple
 from astrbot.api import logger
 from astrbot.api.star import Context
 from .data_manager import DataManager
 from .command_processor import CommandProcessor
+from .tool_selector import ToolSelector
+from .tracing import tracer
 
 
 class DynamicLLMManager:
     """动态LLM函数管理器，用于动态注册和管理LLM函数"""
     
-    def __init__(self, context: Context, data_manager: DataManager, command_processor: CommandProcessor):
+    # 批量执行指令的LLM函数名
+    BATCH_FUNCTION = "run_commands"
+    
+    def __init__(self, context: Context, data_manager: DataManager, command_processor: CommandProcessor, config=None):
         self.context = context
         self.data_manager = data_manager
         self.command_processor = command_processor
-        self.registered_functions = set()  # 记录已注册的函数名
+        self.config = config or {}
+        self.registered_functions: Dict[str, Tuple[str, str]] = {}  # 已注册的函数名 -> (指令名, 描述)
+        self.function_by_command: Dict[str, str] = {}  # 指令名 -> 已注册的函数名
+        self.tool_selector = ToolSelector.from_config(self.config)  # 未启用时为None
+        self.batch_registered = False  # 批量执行函数是否已注册
     
     def register_dynamic_functions(self):
-        """注册所有动态LLM函数"""
+        """注册所有动态LLM函数（只注册尚未注册或有变化的函数）"""
         try:
-            mappings = self.data_manager.list_mappings()
-            for command_name, mapping in mappings.items():
-                llm_function = mapping.get("llm_function")
-                description = mapping.get("description", "")
-                
-                if llm_function and llm_function not in self.registered_functions:
-                    self._register_single_function(command_name, llm_function, description)
-                    self.registered_functions.add(llm_function)
-                    logger.info(f"动态注册LLM函数: {llm_function} -> {command_name}")
-            
+            self.reconcile_functions()
+            self.sync_batch_function()
         except Exception as e:
             logger.error(f"注册动态LLM函数失败: {e}")
     
-    def _register_single_function(self, command_name: str, llm_function: str, description: str):
-        """注册单个LLM函数"""
-        logger.info(f"[dynamic_llm_manager] 注册单个LLM函数: {llm_function} -> {command_name}")
+    def sync_batch_function(self):
+        """有已注册的动态函数时注册批量执行函数，一个都没有时注销"""
+        wanted = bool(self.registered_functions) and self.config.get("batch_enabled", True)
+        if wanted and not self.batch_registered:
+            self.register_batch_function()
+        elif not wanted and self.batch_registered:
+            try:
+                self.context.unregister_llm_tool(self.BATCH_FUNCTION)
+                self.batch_registered = False
+                logger.info(f"[dynamic_llm_manager] 没有可执行的映射，已注销批量执行函数: {self.BATCH_FUNCTION}")
+            except Exception as e:
+                logger.error(f"[dynamic_llm_manager] 注销批量执行函数失败: {e}")
+    
+    def register_batch_function(self):
+        """注册批量执行指令的LLM函数，一次工具调用并发执行多条指令"""
+        if not self.config.get("batch_enabled", True):
+            return
+        if self.BATCH_FUNCTION in self.registered_functions:
+            logger.warning(f"[dynamic_llm_manager] 函数名 {self.BATCH_FUNCTION} 已被指令映射占用，跳过注册批量执行函数")
+            return
+        
+        func_args = [
+            {
+                "type": "string",
+                "name": "commands",
+                "description": 'JSON 数组，每项为 {"command": 指令名或对应的函数名, "args": 指令参数（可选）}，'
+                               '如 [{"command": "rmd ls"}, {"command": "weather", "args": "北京"}]'
+            },
+        ]
+        func_desc = (f"并发执行多条已映射的指令，按顺序一次返回全部结果。需要多条指令的结果时优先使用，"
+                     f"最多 {int(self.config.get('batch_max_commands', 8))} 条")
         
         try:
-            # 创建函数参数定义
-            func_args = [
-                {
-                    "type": "string",
-                    "name": "command_text",
-                    "description": f"要执行的指令，固定值为 '{command_name}'"
-                },
-                {
-                    "type": "string", 
-                    "name": "args",
-                    "description": "指令参数，可选"
-                }
-            ]
+            self.context.provider_manager.llm_tools.add_func(
+                self.BATCH_FUNCTION,
+                func_args,
+                func_desc,
+                self._create_batch_handler()
+            )
+            self.batch_registered = True
+            logger.info(f"[dynamic_llm_manager] 已注册批量执行函数: {self.BATCH_FUNCTION}")
+        except Exception as e:
+            logger.error(f"[dynamic_llm_manager] 注册批量执行函数失败: {e}")
+    
+    def _parse_batch(self, commands) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        """解析批量执行参数，指令可以用映射的函数名指定
+        
+        Returns:
+            (指令列表, 错误信息)
+        """
+        if isinstance(commands, str):
+            try:
+                commands = json.loads(commands)
+            except json.JSONDecodeError as e:
+                return [], f"commands 不是合法的 JSON：{e}"
+        if not isinstance(commands, list) or not commands:
+            return [], "commands 必须是非空的 JSON 数组"
+        
+        max_commands = int(self.config.get("batch_max_commands", 8))
+        if len(commands) > max_commands:
+            return [], f"一次最多执行 {max_commands} 条指令，当前 {len(commands)} 条"
+        
+        items = []
+        for i, entry in enumerate(commands, 1):
+            if isinstance(entry, str):
+                entry = {"command": entry}
+            if not isinstance(entry, dict) or not str(entry.get("command", "")).strip():
+                return [], f"第 {i} 项缺少 command"
+            command = str(entry["command"]).strip()
+            # 允许使用函数名指代指令
+            if command not in self.data_manager.command_mappings and command in self.registered_functions:
+                command = self.registered_functions[command][0]
+            items.append({"command": command, "args": str(entry.get("args") or "")})
+        return items, None
+    
+    def _create_batch_handler(self):
+        """创建批量执行函数"""
+        async def run_commands(event, commands=None, **kwargs):
+            items, error = self._parse_batch(commands)
+            if error:
+                return f"批量执行失败：{error}"
+            blocked = [item["command"] for item in items if not self.command_allowed(item["command"], event)]
+            if blocked:
+                return f"批量执行失败：指令 {', '.join(blocked)} 在当前会话不可用"
             
-            # 创建函数描述
-            func_desc = f"执行指令 '{command_name}'"
-            if description:
-                func_desc += f"，{description}"
+            # 同一次批量调用中的指令共用一个追踪ID
+            trace = tracer.begin()
+            try:
+                tracer.info("批量执行 %d 条指令: %s", len(items), [item["command"] for item in items])
+                results = await self.command_processor.execute_commands(
+                    event, items, float(self.config.get("batch_item_timeout", 0))
+                )
+            finally:
+                tracer.end(trace)
             
-            logger.info(f"[dynamic_llm_manager] 创建函数参数: {func_args}")
-            logger.info(f"[dynamic_llm_manager] 函数描述: {func_desc}")
+            parts = [f"[{i}] {item['command']}\n{result}" for i, (item, result) in enumerate(zip(items, results), 1)]
+            return "批量执行结果：\n\n" + "\n\n".join(parts) + "\n\n请基于以上结果生成回复。"
+        
+        run_commands.__doc__ = '''并发执行多条指令
+        
+        Args:
+            commands(string): JSON 数组，每项包含 command 和可选的 args
+        '''
+        return run_commands
+    
+    def _desired_functions(self) -> Dict[str, Tuple[str, str]]:
+        """根据当前映射计算应注册的函数，同名函数以先添加的映射为准"""
+        desired = {}
+        for command_name, mapping in self.data_manager.command_mappings.items():
+            llm_function = mapping.get("llm_function")
+            if llm_function and llm_function not in desired:
+                desired[llm_function] = (command_name, mapping.get("description", ""))
+        return desired
+    
+    def _apply_function(self, llm_function: str, signature: Tuple[str, str]):
+        """注册或更新单个函数并维护索引"""
+        command_name, description = signature
+        old_command = self.registered_functions.get(llm_function, (None, None))[0]
+        if old_command is not None and old_command != command_name:
+            self.function_by_command.pop(old_command, None)
+        
+        # add_func 会覆盖同名函数，更新时不需要先注销
+        if self._register_single_function(command_name, llm_function, description):
+            self.registered_functions[llm_function] = signature
+            self.function_by_command[command_name] = llm_function
+            if self.tool_selector is not None:
+                self.tool_selector.update(llm_function, command_name, description)
+            logger.info(f"动态注册LLM函数: {llm_function} -> {command_name}")
+    
+    def reconcile_functions(self) -> Tuple[int, int, int]:
+        """对比期望的函数集合与已注册集合，只注册、更新、注销差异部分
+        
+        Returns:
+            (新增数, 更新数, 注销数)
+        """
+        desired = self._desired_functions()
+        added = updated = removed = 0
+        
+        for llm_function in [name for name in self.registered_functions if name not in desired]:
+            self.unregister_function(llm_function)
+            removed += 1
+        
+        for llm_function, signature in desired.items():
+            current = self.registered_functions.get(llm_function)
+            if current == signature:
+                continue
+            if current is None:
+                added += 1
+            else:
+                updated += 1
+            self._apply_function(llm_function, signature)
+        
+        return added, updated, removed
+    
+    def sync_mapping(self, command_name: str):
+        """单个映射变化后增量同步对应的函数，新增和修改映射的耗时与映射总数无关"""
+        try:
+            mapping = self.data_manager.command_mappings.get(command_name)
+            old_function = self.function_by_command.get(command_name)
+            new_function = mapping.get("llm_function") if mapping else None
+            
+            if old_function and old_function != new_function:
+                self.unregister_function(old_function)
+                # 被同名函数遮蔽的映射可能需要接替注册
+                self._sync_function_owner(old_function)
+            
+            if new_function:
+                self._sync_function_owner(new_function, command_name)
+            self.sync_batch_function()
+        except Exception as e:
+            logger.error(f"[dynamic_llm_manager] 同步指令 {command_name} 的LLM函数失败: {e}")
+    
+    def sync_mappings(self, command_names: List[str]):
+        """批量映射变化后一次性同步，耗时只与变化的映射数有关"""
+        for command_name in command_names:
+            self.sync_mapping(command_name)
+        logger.info(f"[dynamic_llm_manager] 已同步 {len(command_names)} 个映射，当前注册了 {len(self.registered_functions)} 个函数")
+    
+    def _sync_function_owner(self, llm_function: str, candidate: Optional[str] = None):
+        """确保函数注册到应持有它的映射上
+        
+        Args:
+            llm_function: 函数名
+            candidate: 刚发生变化、使用该函数名的指令，函数尚未注册时直接由它持有
+        """
+        current = self.registered_functions.get(llm_function)
+        if current is not None:
+            mapping = self.data_manager.command_mappings.get(current[0])
+            if mapping and mapping.get("llm_function") == llm_function:
+                signature = (current[0], mapping.get("description", ""))
+                if signature != current:
+                    self._apply_function(llm_function, signature)
+                return
+            self.unregister_function(llm_function)
+        
+        if candidate is not None:
+            mapping = self.data_manager.command_mappings[candidate]
+            self._apply_function(llm_function, (candidate, mapping.get("description", "")))
+            return
+        
+        # 原持有者已被删除，按函数名索引查找其他使用同名函数的映射接替
+        command_name, mapping = self.data_manager.get_mapping_by_function(llm_function)
+        if command_name is not None:
+            self._apply_function(llm_function, (command_name, mapping.get("description", "")))
+    
+    def _register_single_function(self, command_name: str, llm_function: str, description: str) -> bool:
+        """注册单个LLM函数，返回是否注册成功"""
+        try:
+            # 函数参数定义与描述来自预编译的执行计划
+            plan = self.command_processor.get_plan(command_name)
+            if plan is None:
+                logger.warning(f"[dynamic_llm_manager] 指令 {command_name} 没有映射，跳过注册")
+                return False
+            func_args = plan.function_args()
+            func_desc = plan.function_description()
+            
+            tracer.debug("创建函数参数: %s，函数描述: %s", func_args, func_desc)
             
             # 创建动态处理器
             handler = self._create_dynamic_handler(command_name)
-            logger.info(f"[dynamic_llm_manager] 动态处理器创建完成: {handler}")
             
             # 注册到LLM工具管理器
-            logger.info(f"[dynamic_llm_manager] 开始注册到LLM工具管理器")
             # 直接使用 add_func 方法，绕过 context.register_llm_tool 的bug
             self.context.provider_manager.llm_tools.add_func(
                 llm_function,
@@ -71,19 +262,20 @@ class DynamicLLMManager:
                 func_desc,
                 handler
             )
-            logger.info(f"[dynamic_llm_manager] LLM函数注册完成: {llm_function}")
+            tracer.debug("LLM函数注册完成: %s", llm_function)
+            return True
             
         except Exception as e:
             logger.error(f"[dynamic_llm_manager] 注册LLM函数 {llm_function} 失败: {e}")
             import traceback
             logger.error(f"[dynamic_llm_manager] 错误堆栈:\n{traceback.format_exc()}")
+            return False
     
     def _create_dynamic_handler(self, command_name: str):
         """创建动态处理函数"""
-        logger.info(f"[dynamic_llm_manager] 创建动态处理函数: {command_name}")
-        
         async def dynamic_handler(event, **kwargs):
-            logger.info(f"[dynamic_llm_manager] 动态函数 {command_name} 被调用，参数: {kwargs}")
+            trace = tracer.begin()
+            tracer.debug("动态函数 %s 被调用，参数: %s", command_name, kwargs)
             
             # 获取参数
             command_text = kwargs.get('command_text', command_name)
@@ -93,11 +285,12 @@ class DynamicLLMManager:
             if command_text != command_name:
                 command_text = command_name
             
-            logger.info(f"[dynamic_llm_manager] 执行指令: '{command_text}', 参数: '{args}'")
-            
             try:
+                if not self.command_allowed(command_name, event):
+                    return f"指令 {command_name} 在当前会话不可用。"
+                
                 result = await self.command_processor.execute_command(event, command_text, args)
-                logger.info(f"[dynamic_llm_manager] 指令执行完成，结果长度: {len(str(result))}")
+                tracer.info("指令 %s 执行完成，结果长度: %d", command_text, len(result))
                 
                 # 返回指令结果，让AI基于这个结果生成回复
                 return f"指令执行结果：{result}\n\n请基于以上结果生成回复。"
@@ -107,6 +300,8 @@ class DynamicLLMManager:
                 import traceback
                 logger.error(f"[dynamic_llm_manager] 错误堆栈:\n{traceback.format_exc()}")
                 raise
+            finally:
+                tracer.end(trace)
         
         # 设置函数名和文档字符串
         safe_name = command_name.replace(' ', '_').replace('-', '_')
@@ -118,34 +313,82 @@ class DynamicLLMManager:
             args(string): 指令参数，可选
         '''
         
-        logger.info(f"[dynamic_llm_manager] 动态处理函数创建完成: {dynamic_handler.__name__}")
         return dynamic_handler
     
+    def command_allowed(self, command_name: str, event) -> bool:
+        """指令在事件所属会话和发送者角色下是否可用"""
+        return self.data_manager.scopes.allows(command_name, event.unified_msg_origin,
+                                               getattr(event, "role", "member"))
+    
+    def filter_request_tools(self, event, req):
+        """精简LLM请求的工具列表中的动态函数
+        
+        先移除当前会话不可用的函数；启用了函数筛选时，再只保留与用户消息最相关的 top_k 个。
+        其他插件的工具和批量执行函数不受影响。
+        工具列表可能是框架共享的对象，因此复制后替换，不修改原列表。
+        同时兼容 ToolSet（tools 属性）与旧版 FuncCall（func_list 属性）。
+        """
+        func_tool = getattr(req, "func_tool", None)
+        if func_tool is None or not self.registered_functions:
+            return
+        
+        hidden = frozenset()
+        if self.data_manager.scopes.scopes:
+            hidden = self.data_manager.scopes.hidden(event.unified_msg_origin, getattr(event, "role", "member"))
+        
+        selected = None
+        if self.tool_selector is not None:
+            query = getattr(req, "prompt", None) or event.message_str or ""
+            selected = self.tool_selector.select(
+                query, lambda name: self.registered_functions[name][0] not in hidden
+            )
+            if selected is not None:
+                selected = set(selected)
+                tracer.debug("按相关度为本次请求选择了动态函数: %s", selected)
+        
+        if not hidden and selected is None:
+            return
+        
+        def keep(tool) -> bool:
+            signature = self.registered_functions.get(getattr(tool, "name", None))
+            if signature is None:
+                return True
+            return signature[0] not in hidden and (selected is None or tool.name in selected)
+        
+        for attr in ("tools", "func_list"):
+            tools = getattr(func_tool, attr, None)
+            if not isinstance(tools, list):
+                continue
+            kept = [tool for tool in tools if keep(tool)]
+            if len(kept) != len(tools):
+                filtered = copy.copy(func_tool)
+                setattr(filtered, attr, kept)
+                req.func_tool = filtered
+                tracer.debug("会话 %s 的请求省略了 %d 个动态函数", event.unified_msg_origin, len(tools) - len(kept))
+            return
+    
     def unregister_function(self, llm_function: str):
         """注销LLM函数"""
         try:
             if llm_function in self.registered_functions:
                 self.context.unregister_llm_tool(llm_function)
-                self.registered_functions.remove(llm_function)
+                command_name = self.registered_functions.pop(llm_function)[0]
+                if self.function_by_command.get(command_name) == llm_function:
+                    del self.function_by_command[command_name]
+                if self.tool_selector is not None:
+                    self.tool_selector.remove(llm_function)
                 logger.info(f"注销LLM函数: {llm_function}")
         except Exception as e:
             logger.error(f"注销LLM函数 {llm_function} 失败: {e}")
     
     def refresh_functions(self):
-        """刷新所有动态函数"""
+        """刷新所有动态函数，只处理与当前映射不一致的部分，未变化的函数保持注册"""
         logger.info(f"[dynamic_llm_manager] 开始刷新动态LLM函数")
         
         try:
-            # 注销所有已注册的函数
-            logger.info(f"[dynamic_llm_manager] 注销已注册的 {len(self.registered_functions)} 个函数")
-            for func_name in list(self.registered_functions):
-                self.unregister_function(func_name)
-            
-            # 重新注册所有函数
-            logger.info(f"[dynamic_llm_manager] 重新注册所有函数")
-            self.register_dynamic_functions()
-            
-            logger.info(f"[dynamic_llm_manager] 刷新动态LLM函数完成，当前注册了 {len(self.registered_functions)} 个函数")
+            added, updated, removed = self.reconcile_functions()
+            self.sync_batch_function()
+            logger.info(f"[dynamic_llm_manager] 刷新动态LLM函数完成，新增 {added} 个，更新 {updated} 个，注销 {removed} 个，当前注册了 {len(self.registered_functions)} 个函数")
             
         except Exception as e:
             logger.error(f"[dynamic_llm_manager] 刷新动态LLM函数失败: {e}")
@@ -1,50 +1,75 @@
+import copy
 import time
-from typing import Optional
+import functools
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
 from astrbot.api import logger
 from astrbot.core.platform.astr_message_event import AstrMessageEvent
 from astrbot.core.platform.astrbot_message import AstrBotMessage, MessageType
 from astrbot.core.platform.platform_metadata import PlatformMetadata
 from astrbot.core.message.components import Plain
+from astrbot.api.platform import MessageMember
+from .message_ids import message_ids
+from .tracing import tracer
+from .platform_adapters import get_platform_adapter, match_platform_adapter, registry_version
+
+
+class PlatformResolution(NamedTuple):
+    """单个platform_id的解析结果"""
+    platform_name: str  # 平台类型
+    meta: PlatformMetadata  # 平台元数据
+    constructor: Optional[functools.partial]  # 已绑定平台客户端的事件构造器，为空时使用基础事件
+    version: int  # 解析时的平台适配注册表版本
+
+
+class EventTemplate(NamedTuple):
+    """同一会话、同一发送者的事件模板"""
+    platform_id: str  # 平台ID
+    session_id: str  # 会话ID
+    message: AstrBotMessage  # 预先构建好不变部分的消息对象
 
 
 class EventFactory:
     """事件工厂类，用于创建不同平台类型的事件对象"""
     
+    # 事件模板缓存上限
+    MAX_TEMPLATES = 256
+    
     def __init__(self, context):
         self.context = context
+        self._platform_cache: Dict[str, PlatformResolution] = {}  # platform_id -> 解析结果
+        self._templates: "OrderedDict[tuple, EventTemplate]" = OrderedDict()  # (会话, 发送者ID, 昵称) -> 事件模板
     
     def _infer_platform_name_from_id(self, platform_id: str) -> str:
         """从platform_id推断platform_name（平台类型）"""
-        # 常见的平台ID模式匹配
-        platform_id_lower = platform_id.lower()
-        
-        if "aiocqhttp" in platform_id_lower or "onebot" in platform_id_lower:
-            return "aiocqhttp"
-        elif "qq_official" in platform_id_lower or "qqofficial" in platform_id_lower:
-            return "qq_official"
-        elif "telegram" in platform_id_lower or "tg" in platform_id_lower:
-            return "telegram"
-        elif "discord" in platform_id_lower:
-            return "discord"
-        elif "slack" in platform_id_lower:
-            return "slack"
-        elif "lark" in platform_id_lower:
-            return "lark"
-        elif "wechat" in platform_id_lower:
-            if "padpro" in platform_id_lower:
-                return "wechatpadpro"
-            else:
-                return "webchat"
-        elif "dingtalk" in platform_id_lower:
-            return "dingtalk"
-        else:
-            # 如果无法推断，返回platform_id本身作为fallback
-            # 这样可以保持兼容性
-            logger.warning(f"无法从platform_id '{platform_id}' 推断平台类型，使用原值")
-            return platform_id
+        adapter = match_platform_adapter(platform_id)
+        if adapter is not None:
+            return adapter.name
+        
+        # 如果无法推断，返回platform_id本身作为fallback
+        # 这样可以保持兼容性
+        logger.warning(f"无法从platform_id '{platform_id}' 推断平台类型，使用原值")
+        return platform_id
     
     def create_event(self, unified_msg_origin: str, command: str, creator_id: str, creator_name: str = None) -> AstrMessageEvent:
         """创建事件对象，根据平台类型自动选择正确的事件类"""
+        # 同一会话、同一发送者的不变部分只构建一次
+        template = self._get_template(unified_msg_origin, creator_id, creator_name)
+        
+        # 创建基础消息对象
+        msg = self._create_message_object(command, template)
+        
+        # 根据平台类型创建正确的事件对象，平台解析结果按platform_id缓存
+        resolution = self._resolve_platform(template.platform_id)
+        return self._create_platform_specific_event(resolution, command, msg, template.session_id)
+    
+    def _get_template(self, unified_msg_origin: str, creator_id: str, creator_name: str = None) -> EventTemplate:
+        """获取会话与发送者对应的事件模板，按最近使用淘汰"""
+        key = (unified_msg_origin, creator_id, creator_name)
+        template = self._templates.get(key)
+        if template is not None:
+            self._templates.move_to_end(key)
+            return template
         
         # 解析平台信息
         platform_id = "unknown"  # v4中第一部分是platform_id，不是platform_name
@@ -63,29 +88,22 @@ class EventFactory:
                 elif "FriendMessage" in msg_type_str:
                     message_type = MessageType.FRIEND_MESSAGE
         
-        # 创建基础消息对象
-        msg = self._create_message_object(command, session_id, message_type, creator_id, creator_name)
-        
-        # 创建平台元数据 - 在v4中需要正确设置id字段
-        # 尝试从platform_id推断platform_name（类型）
-        platform_name = self._infer_platform_name_from_id(platform_id)
-        meta = PlatformMetadata(platform_name, "command_to_llm", id=platform_id)
-        
-        # 根据平台类型创建正确的事件对象
-        return self._create_platform_specific_event(platform_name, command, msg, meta, session_id)
+        message = self._create_message_template(session_id, message_type, creator_id, creator_name)
+        template = EventTemplate(platform_id, session_id, message)
+        self._templates[key] = template
+        if len(self._templates) > self.MAX_TEMPLATES:
+            self._templates.popitem(last=False)
+        return template
     
-    def _create_message_object(self, command: str, session_id: str, message_type: MessageType, 
-                              creator_id: str, creator_name: str = None) -> AstrBotMessage:
-        """创建消息对象"""
+    def _create_message_template(self, session_id: str, message_type: MessageType,
+                                 creator_id: str, creator_name: str = None) -> AstrBotMessage:
+        """创建消息模板，只包含与指令内容无关的部分"""
         msg = AstrBotMessage()
-        msg.message_str = command
         msg.session_id = session_id
         msg.type = message_type
         msg.self_id = "astrbot_command_to_llm"
-        msg.message_id = "command_to_llm_" + str(int(time.time()))
         
         # 设置发送者信息
-        from astrbot.api.platform import MessageMember
         msg.sender = MessageMember(creator_id, creator_name or "用户")
         
         # 设置群组ID（如果是群聊）
@@ -98,12 +116,9 @@ class EventFactory:
                 group_id = session_id
             msg.group_id = group_id
         
-        # 设置消息链
-        msg.message = [Plain(command)]
-        
-        # 设置raw_message属性（模拟原始消息对象）
+        # 设置raw_message属性（模拟原始消息对象），message字段在创建消息时填入
         msg.raw_message = {
-            "message": command,
+            "message": "",
             "message_type": message_type.value,
             "sender": {"user_id": creator_id, "nickname": creator_name or "用户"},
             "self_id": "astrbot_command_to_llm"
@@ -111,217 +126,80 @@ class EventFactory:
         
         return msg
     
-    def _create_platform_specific_event(self, platform_name: str, command: str, msg: AstrBotMessage, 
-                                       meta: PlatformMetadata, session_id: str) -> AstrMessageEvent:
-        """根据平台类型创建特定的事件对象"""
-        
-        if platform_name == "aiocqhttp":
-            return self._create_aiocqhttp_event(command, msg, meta, session_id)
-        elif platform_name == "qq_official":
-            return self._create_qq_official_event(command, msg, meta, session_id)
-        elif platform_name == "telegram":
-            return self._create_telegram_event(command, msg, meta, session_id)
-        elif platform_name == "discord":
-            return self._create_discord_event(command, msg, meta, session_id)
-        elif platform_name == "slack":
-            return self._create_slack_event(command, msg, meta, session_id)
-        elif platform_name == "lark":
-            return self._create_lark_event(command, msg, meta, session_id)
-        elif platform_name == "wechatpadpro":
-            return self._create_wechatpadpro_event(command, msg, meta, session_id)
-        elif platform_name == "webchat":
-            return self._create_webchat_event(command, msg, meta, session_id)
-        elif platform_name == "dingtalk":
-            return self._create_dingtalk_event(command, msg, meta, session_id)
-        else:
-            # 默认使用基础事件对象
-            return self._create_base_event(command, msg, meta, session_id)
-    
-    def _create_aiocqhttp_event(self, command: str, msg: AstrBotMessage, meta: PlatformMetadata, session_id: str) -> AstrMessageEvent:
-        """创建 aiocqhttp 平台事件"""
-        try:
-            # 使用v4的方法：通过platform_id获取平台实例
-            platform = self.context.get_platform_inst(meta.id)
-            if platform and hasattr(platform, 'bot'):
-                from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import AiocqhttpMessageEvent
-                event = AiocqhttpMessageEvent(
-                    message_str=command,
-                    message_obj=msg,
-                    platform_meta=meta,
-                    session_id=session_id,
-                    bot=platform.bot
-                )
-                logger.info("成功创建 AiocqhttpMessageEvent")
-                return event
-        except Exception as e:
-            logger.warning(f"创建 AiocqhttpMessageEvent 失败: {e}")
-        
-        # 回退到基础事件
-        return self._create_base_event(command, msg, meta, session_id)
-    
-    def _create_qq_official_event(self, command: str, msg: AstrBotMessage, meta: PlatformMetadata, session_id: str) -> AstrMessageEvent:
-        """创建 QQ 官方平台事件"""
-        try:
-            # 使用v4的方法：通过platform_id获取平台实例
-            platform = self.context.get_platform_inst(meta.id)
-            if platform and hasattr(platform, 'client'):
-                from astrbot.core.platform.sources.qqofficial.qqofficial_message_event import QQOfficialMessageEvent
-                event = QQOfficialMessageEvent(
-                    message_str=command,
-                    message_obj=msg,
-                    platform_meta=meta,
-                    session_id=session_id,
-                    bot=platform.client
-                )
-                logger.info("成功创建 QQOfficialMessageEvent")
-                return event
-        except Exception as e:
-            logger.warning(f"创建 QQOfficialMessageEvent 失败: {e}")
+    def _create_message_object(self, command: str, template: EventTemplate) -> AstrBotMessage:
+        """基于模板创建消息对象，只替换指令内容和消息ID
         
-        return self._create_base_event(command, msg, meta, session_id)
-    
-    def _create_telegram_event(self, command: str, msg: AstrBotMessage, meta: PlatformMetadata, session_id: str) -> AstrMessageEvent:
-        """创建 Telegram 平台事件"""
-        try:
-            # 使用v4的方法：通过platform_id获取平台实例
-            platform = self.context.get_platform_inst(meta.id)
-            if platform and hasattr(platform, 'client'):
-                from astrbot.core.platform.sources.telegram.tg_event import TelegramPlatformEvent
-                event = TelegramPlatformEvent(
-                    message_str=command,
-                    message_obj=msg,
-                    platform_meta=meta,
-                    session_id=session_id,
-                    client=platform.client
-                )
-                logger.info("成功创建 TelegramPlatformEvent")
-                return event
-        except Exception as e:
-            logger.warning(f"创建 TelegramPlatformEvent 失败: {e}")
+        发送者等对象在同一模板创建的消息之间共享，应视为只读。
+        """
+        msg = copy.copy(template.message)
+        msg.message_str = command
+        msg.message_id = message_ids.next_id()
+        msg.timestamp = int(time.time())
         
-        return self._create_base_event(command, msg, meta, session_id)
-    
-    def _create_discord_event(self, command: str, msg: AstrBotMessage, meta: PlatformMetadata, session_id: str) -> AstrMessageEvent:
-        """创建 Discord 平台事件"""
-        try:
-            # 使用v4的方法：通过platform_id获取平台实例
-            platform = self.context.get_platform_inst(meta.id)
-            if platform and hasattr(platform, 'client'):
-                from astrbot.core.platform.sources.discord.discord_platform_event import DiscordPlatformEvent
-                event = DiscordPlatformEvent(
-                    message_str=command,
-                    message_obj=msg,
-                    platform_meta=meta,
-                    session_id=session_id,
-                    client=platform.client
-                )
-                logger.info("成功创建 DiscordPlatformEvent")
-                return event
-        except Exception as e:
-            logger.warning(f"创建 DiscordPlatformEvent 失败: {e}")
+        # 设置消息链
+        msg.message = [Plain(command)]
         
-        return self._create_base_event(command, msg, meta, session_id)
-    
-    def _create_slack_event(self, command: str, msg: AstrBotMessage, meta: PlatformMetadata, session_id: str) -> AstrMessageEvent:
-        """创建 Slack 平台事件"""
-        try:
-            # 使用v4的方法：通过platform_id获取平台实例
-            platform = self.context.get_platform_inst(meta.id)
-            if platform and hasattr(platform, 'web_client'):
-                from astrbot.core.platform.sources.slack.slack_event import SlackMessageEvent
-                event = SlackMessageEvent(
-                    message_str=command,
-                    message_obj=msg,
-                    platform_meta=meta,
-                    session_id=session_id,
-                    web_client=platform.web_client
-                )
-                logger.info("成功创建 SlackMessageEvent")
-                return event
-        except Exception as e:
-            logger.warning(f"创建 SlackMessageEvent 失败: {e}")
+        raw_message = dict(template.message.raw_message)
+        raw_message["message"] = command
+        msg.raw_message = raw_message
         
-        return self._create_base_event(command, msg, meta, session_id)
+        return msg
     
-    def _create_lark_event(self, command: str, msg: AstrBotMessage, meta: PlatformMetadata, session_id: str) -> AstrMessageEvent:
-        """创建 Lark 平台事件"""
-        try:
-            # 使用v4的方法：通过platform_id获取平台实例
-            platform = self.context.get_platform_inst(meta.id)
-            if platform and hasattr(platform, 'bot'):
-                from astrbot.core.platform.sources.lark.lark_event import LarkMessageEvent
-                event = LarkMessageEvent(
-                    message_str=command,
-                    message_obj=msg,
-                    platform_meta=meta,
-                    session_id=session_id,
-                    bot=platform.bot
-                )
-                logger.info("成功创建 LarkMessageEvent")
-                return event
-        except Exception as e:
-            logger.warning(f"创建 LarkMessageEvent 失败: {e}")
+    def _resolve_platform(self, platform_id: str) -> PlatformResolution:
+        """解析platform_id对应的平台类型、元数据和事件构造器，结果按platform_id缓存"""
+        resolution = self._platform_cache.get(platform_id)
+        if resolution is not None and resolution.version == registry_version():
+            return resolution
+        
+        # 优先使用平台实例声明的类型，其次从platform_id推断
+        platform = self.context.get_platform_inst(platform_id)
+        adapter = None
+        if platform is not None and hasattr(platform, 'meta'):
+            try:
+                adapter = get_platform_adapter(platform.meta().name)
+            except Exception as e:
+                logger.warning(f"读取平台 {platform_id} 的元数据失败: {e}")
+        platform_name = adapter.name if adapter else self._infer_platform_name_from_id(platform_id)
+        if adapter is None:
+            adapter = get_platform_adapter(platform_name)
         
-        return self._create_base_event(command, msg, meta, session_id)
-    
-    def _create_wechatpadpro_event(self, command: str, msg: AstrBotMessage, meta: PlatformMetadata, session_id: str) -> AstrMessageEvent:
-        """创建 WeChatPadPro 平台事件"""
-        try:
-            # 使用v4的方法：通过platform_id获取平台实例
-            platform = self.context.get_platform_inst(meta.id)
-            if platform:
-                from astrbot.core.platform.sources.wechatpadpro.wechatpadpro_message_event import WeChatPadProMessageEvent
-                event = WeChatPadProMessageEvent(
-                    message_str=command,
-                    message_obj=msg,
-                    platform_meta=meta,
-                    session_id=session_id,
-                    adapter=platform
-                )
-                logger.info("成功创建 WeChatPadProMessageEvent")
-                return event
-        except Exception as e:
-            logger.warning(f"创建 WeChatPadProMessageEvent 失败: {e}")
+        # 创建平台元数据 - 在v4中需要正确设置id字段
+        meta = PlatformMetadata(platform_name, "command_to_llm", id=platform_id)
         
-        return self._create_base_event(command, msg, meta, session_id)
+        constructor = None
+        if adapter is not None:
+            try:
+                constructor = adapter.build_constructor(platform)
+            except Exception as e:
+                logger.warning(f"获取 {platform_name} 平台事件类失败: {e}")
+        
+        resolution = PlatformResolution(platform_name, meta, constructor, registry_version())
+        self._platform_cache[platform_id] = resolution
+        logger.info(f"已解析平台 {platform_id}：类型 {platform_name}，事件类 "
+                    f"{constructor.func.__name__ if constructor else 'AstrMessageEvent'}")
+        return resolution
     
-    def _create_webchat_event(self, command: str, msg: AstrBotMessage, meta: PlatformMetadata, session_id: str) -> AstrMessageEvent:
-        """创建 WebChat 平台事件"""
-        try:
-            from astrbot.core.platform.sources.webchat.webchat_event import WebChatMessageEvent
-            event = WebChatMessageEvent(
-                message_str=command,
-                message_obj=msg,
-                platform_meta=meta,
-                session_id=session_id
-            )
-            logger.info("成功创建 WebChatMessageEvent")
-            return event
-        except Exception as e:
-            logger.warning(f"创建 WebChatMessageEvent 失败: {e}")
-        
-        return self._create_base_event(command, msg, meta, session_id)
+    def invalidate_platform_cache(self):
+        """清空平台解析缓存，平台重新加载后调用"""
+        self._platform_cache.clear()
+        logger.info("已清空平台解析缓存")
     
-    def _create_dingtalk_event(self, command: str, msg: AstrBotMessage, meta: PlatformMetadata, session_id: str) -> AstrMessageEvent:
-        """创建钉钉平台事件"""
-        try:
-            # 使用v4的方法：通过platform_id获取平台实例
-            platform = self.context.get_platform_inst(meta.id)
-            if platform and hasattr(platform, 'client'):
-                from astrbot.core.platform.sources.dingtalk.dingtalk_event import DingtalkMessageEvent
-                event = DingtalkMessageEvent(
+    def _create_platform_specific_event(self, resolution: PlatformResolution, command: str, msg: AstrBotMessage,
+                                       session_id: str) -> AstrMessageEvent:
+        """使用缓存的事件构造器创建平台事件对象"""
+        if resolution.constructor is not None:
+            try:
+                return resolution.constructor(
                     message_str=command,
                     message_obj=msg,
-                    platform_meta=meta,
-                    session_id=session_id,
-                    client=platform.client
+                    platform_meta=resolution.meta,
+                    session_id=session_id
                 )
-                logger.info("成功创建 DingtalkMessageEvent")
-                return event
-        except Exception as e:
-            logger.warning(f"创建 DingtalkMessageEvent 失败: {e}")
+            except Exception as e:
+                logger.warning(f"创建 {resolution.constructor.func.__name__} 失败: {e}")
         
-        return self._create_base_event(command, msg, meta, session_id)
+        # 回退到基础事件
+        return self._create_base_event(command, msg, resolution.meta, session_id)
     
     def _create_base_event(self, command: str, msg: AstrBotMessage, meta: PlatformMetadata, session_id: str) -> AstrMessageEvent:
         """创建基础事件对象（作为回退方案）"""
@@ -340,5 +218,5 @@ class EventFactory:
         event.is_wake = True  # 标记为唤醒状态
         event.is_at_or_wake_command = True  # 标记为指令
         
-        logger.info("使用基础 AstrMessageEvent")
+        tracer.debug("平台 %s 使用基础 AstrMessageEvent", meta.id)
         return event 
\ No newline at end of file
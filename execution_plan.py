@@ -0,0 +1,77 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from astrbot.api.message_components import Plain
+from .capture_session import CapturePolicy
+
+
+@dataclass(frozen=True, eq=False)
+class ExecutionPlan:
+    """由指令映射预编译得到的不可变执行计划
+
+    映射变化时重新编译，执行时不再重复解析映射和配置。
+    """
+
+    command_name: str  # 指令名，如 "rmd ls"
+    llm_function: str  # LLM函数名
+    description: str  # 映射描述
+    command_prefix: str  # 规范化的指令前缀，如 "/rmd ls"
+    arg_schema: Tuple[Dict, ...]  # LLM函数参数定义
+    forward_prefix: Tuple[Plain, ...]  # 转发到会话时附加在结果前的消息组件
+    capture_policy: CapturePolicy  # 捕获策略
+    cache_ttl: float  # 结果缓存有效期，0 为不缓存
+    dedup_scope: str  # 相同请求合并范围
+    max_concurrency: Optional[int]  # 该映射的并发上限，为空时使用全局配置
+    dispatch_mode: str  # 执行方式：queue 提交到事件队列，direct 直接调用处理函数
+    stream: bool  # 是否流式转发，每条响应捕获后立即转发
+    source: Dict  # 编译来源的映射对象，用于判断计划是否过期
+
+    @classmethod
+    def compile(cls, command_name: str, mapping: Dict, config) -> "ExecutionPlan":
+        """编译指令映射，映射选项优先于全局配置"""
+        config = config or {}
+        max_concurrency = mapping.get("max_concurrency")
+        return cls(
+            command_name=command_name,
+            llm_function=mapping.get("llm_function", ""),
+            description=mapping.get("description", ""),
+            command_prefix=f"/{' '.join(command_name.split())}",
+            arg_schema=cls._build_arg_schema(command_name),
+            forward_prefix=(Plain(f"[指令执行] {command_name}\n"),),
+            capture_policy=CapturePolicy.from_config(config, mapping),
+            cache_ttl=float(mapping.get("cache_ttl", 0) or 0),
+            dedup_scope=mapping.get("dedup_scope", config.get("dedup_scope", "off")),
+            max_concurrency=int(max_concurrency) if max_concurrency is not None else None,
+            dispatch_mode=mapping.get("dispatch_mode", config.get("dispatch_mode", "queue")),
+            stream=bool(mapping.get("stream", config.get("stream", False))),
+            source=mapping,
+        )
+
+    @staticmethod
+    def _build_arg_schema(command_name: str) -> Tuple[Dict, ...]:
+        """LLM函数参数定义"""
+        return (
+            {
+                "type": "string",
+                "name": "command_text",
+                "description": f"要执行的指令，固定值为 '{command_name}'"
+            },
+            {
+                "type": "string",
+                "name": "args",
+                "description": "指令参数，可选"
+            },
+        )
+
+    def build_command(self, args: str = "") -> str:
+        """拼接带参数的完整指令"""
+        return f"{self.command_prefix} {args}" if args else self.command_prefix
+
+    def function_args(self) -> List[Dict]:
+        """供注册LLM函数使用的参数定义副本"""
+        return [dict(arg) for arg in self.arg_schema]
+
+    def function_description(self) -> str:
+        """LLM函数描述"""
+        if self.description:
+            return f"执行指令 '{self.command_name}'，{self.description}"
+        return f"执行指令 '{self.command_name}'"
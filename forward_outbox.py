@@ -0,0 +1,105 @@
+import time
+import asyncio
+from typing import Dict
+from astrbot.api import logger
+from astrbot.core.message.message_event_result import MessageChain
+from .send_scheduler import SendScheduler
+from .metrics import Metrics
+
+
+class ForwardOutbox:
+    """后台转发队列
+
+    每个会话一个有界队列和一个发送任务，调用方提交后立即返回，不必等待平台网络I/O；
+    同一会话内的消息按提交顺序发送。队列已满时丢弃新消息，发送失败时记录错误并继续。
+    """
+
+    # 发送任务空闲多久后退出（秒），会话再次有消息时重新创建
+    IDLE_TIMEOUT = 30.0
+
+    def __init__(self, send_scheduler: SendScheduler, max_pending: int = 32, metrics: Metrics = None):
+        self.send_scheduler = send_scheduler
+        self.metrics = metrics  # 记录从提交到发送完成的转发耗时
+        self.max_pending = max(1, max_pending)
+        self._queues: Dict[str, asyncio.Queue] = {}  # 会话 -> 待发送消息
+        self._workers: Dict[str, asyncio.Task] = {}  # 会话 -> 发送任务
+
+        # 指标
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, unified_msg_origin: str, message_chain: MessageChain, mapping_key: str = None) -> bool:
+        """提交一条待转发的消息，队列已满时丢弃并返回False
+        
+        Args:
+            mapping_key: 消息所属的映射，用于记录转发耗时
+        """
+        queue = self._queues.get(unified_msg_origin)
+        if queue is None:
+            queue = asyncio.Queue(self.max_pending)
+            self._queues[unified_msg_origin] = queue
+
+        try:
+            queue.put_nowait((message_chain, mapping_key, time.monotonic()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"会话 {unified_msg_origin} 的转发队列已满（{self.max_pending}），丢弃一条消息")
+            return False
+
+        worker = self._workers.get(unified_msg_origin)
+        if worker is None or worker.done():
+            self._workers[unified_msg_origin] = asyncio.create_task(self._run(unified_msg_origin, queue))
+        return True
+
+    async def _run(self, unified_msg_origin: str, queue: asyncio.Queue):
+        """按顺序发送会话队列中的消息，空闲超时后退出"""
+        while True:
+            try:
+                message_chain, mapping_key, submitted_at = await asyncio.wait_for(queue.get(),
+                                                                                  timeout=self.IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if not queue.empty():
+                    continue
+                # 等待期间没有新消息，队列为空，可以安全移除
+                self._queues.pop(unified_msg_origin, None)
+                self._workers.pop(unified_msg_origin, None)
+                return
+
+            try:
+                await self.send_scheduler.send(unified_msg_origin, message_chain)
+                self.delivered += 1
+                if self.metrics is not None and mapping_key is not None:
+                    self.metrics.observe(mapping_key, "forward", (time.monotonic() - submitted_at) * 1000)
+            except Exception as e:
+                self.failed += 1
+                if self.metrics is not None and mapping_key is not None:
+                    self.metrics.incr(mapping_key, "errors")
+                logger.error(f"转发消息到会话 {unified_msg_origin} 失败: {e}")
+            finally:
+                queue.task_done()
+
+    async def drain(self, timeout: float = 10.0):
+        """等待已提交的消息发送完毕（最多 timeout 秒），然后停止所有发送任务"""
+        queues = list(self._queues.values())
+        if queues:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in queues)), timeout=timeout)
+            except asyncio.TimeoutError:
+                remaining = sum(queue.qsize() for queue in queues)
+                logger.warning(f"等待转发队列清空超时，{remaining} 条消息未发送")
+
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+        self._queues.clear()
+
+    def snapshot(self) -> Dict[str, int]:
+        """队列深度与计数指标"""
+        return {
+            "pending": sum(queue.qsize() for queue in self._queues.values()),
+            "sessions": len(self._queues),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
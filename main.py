@@ -3,26 +3,31 @@ from astrbot.api.star import Context, Star, register
 from astrbot.api.message_components import *
 from astrbot.api.event.filter import command, command_group
 from astrbot.api import logger, AstrBotConfig
+from astrbot.api.provider import ProviderRequest
 import os
 from .command_processor import CommandProcessor
 from .data_manager import DataManager
 from .dynamic_llm_manager import DynamicLLMManager
 from .event_factory import EventFactory
 from .command_trigger import CommandTrigger
+from .utils import CommandUtils
+from .tracing import tracer
 
 @register("command_to_llm", "kjqwdw", "将指令转换为LLM函数调用", "1.0.1")
 class CommandToLLM(Star):
     def __init__(self, context: Context, config: AstrBotConfig = None):
         super().__init__(context)
+        self.config = config or {}
+        tracer.configure(self.config)
         
         # 初始化数据管理器
-        self.data_manager = DataManager(context)
+        self.data_manager = DataManager(context, self.config)
         
         # 初始化指令处理器
         self.command_processor = CommandProcessor(self)
         
         # 初始化动态LLM管理器
-        self.dynamic_llm_manager = DynamicLLMManager(context, self.data_manager, self.command_processor)
+        self.dynamic_llm_manager = DynamicLLMManager(context, self.data_manager, self.command_processor, self.config)
         
         # 注册动态LLM函数
         self.dynamic_llm_manager.register_dynamic_functions()
@@ -31,6 +36,19 @@ class CommandToLLM(Star):
 
 
 
+    @filter.on_platform_loaded()
+    async def on_platform_loaded(self):
+        '''平台加载或重载后清空平台解析缓存'''
+        self.command_processor.command_executor.command_trigger.event_factory.invalidate_platform_cache()
+
+    @filter.on_llm_request()
+    async def on_llm_request(self, event: AstrMessageEvent, req: ProviderRequest):
+        '''只向LLM提供当前会话可用（启用函数筛选时还需与消息相关）的动态函数'''
+        try:
+            self.dynamic_llm_manager.filter_request_tools(event, req)
+        except Exception as e:
+            logger.error(f"过滤LLM请求的动态函数失败: {e}")
+
     # 命令组定义
     @command_group("cmd2llm")
     def cmd2llm(self):
@@ -78,6 +96,43 @@ class CommandToLLM(Star):
         async for result in self.command_processor.remove_mapping(event, command_name):
             yield result
 
+    @cmd2llm.command("set")
+    async def set_mapping_option(self, event: AstrMessageEvent, command_str: str, key: str, value: str):
+        '''设置指令映射选项
+        
+        格式：/cmd2llm set <指令名> <选项> <值>
+        示例：/cmd2llm set rmd--ls capture_policy quiet
+        '''
+        # 解析指令名（将 -- 替换为空格）
+        command_name = command_str.replace("--", " ")
+        async for result in self.command_processor.set_mapping_option(event, command_name, key, value):
+            yield result
+
+    @cmd2llm.command("import")
+    async def import_mappings(self, event: AstrMessageEvent):
+        '''批量导入指令映射
+        
+        格式：/cmd2llm import [overwrite] <JSON/YAML/CSV数据>
+        数据可以换行书写在指令之后，格式自动识别
+        '''
+        payload = CommandUtils.extract_payload(event.message_str, "import")
+        overwrite = False
+        if payload.startswith("overwrite"):
+            overwrite = True
+            payload = payload[len("overwrite"):].strip()
+        
+        async for result in self.command_processor.import_mappings(event, payload, overwrite):
+            yield result
+
+    @cmd2llm.command("export")
+    async def export_mappings(self, event: AstrMessageEvent, fmt: str = "json"):
+        '''批量导出指令映射
+        
+        格式：/cmd2llm export [json|yaml|csv]
+        '''
+        async for result in self.command_processor.export_mappings(event, fmt.lower()):
+            yield result
+
     @cmd2llm.command("exec")
     async def execute_cmd(self, event: AstrMessageEvent, command_str: str, args: str = ""):
         '''执行指令
@@ -91,6 +146,40 @@ class CommandToLLM(Star):
         async for result in self.command_processor.execute_command(event, command_text, args):
             yield result
 
+    @cmd2llm.command("cache")
+    async def manage_cache(self, event: AstrMessageEvent, action: str = "stats", command_str: str = ""):
+        '''查看或清除结果缓存
+        
+        格式：/cmd2llm cache [stats|clear] [指令名]
+        '''
+        if action == "clear":
+            command_name = command_str.replace("--", " ") if command_str else None
+            async for result in self.command_processor.clear_cache(event, command_name):
+                yield result
+        else:
+            async for result in self.command_processor.show_cache_stats(event):
+                yield result
+
+    @cmd2llm.command("queue")
+    async def show_queue(self, event: AstrMessageEvent):
+        '''查看指令执行并发与等待队列状态'''
+        async for result in self.command_processor.show_queue_stats(event):
+            yield result
+
+    @cmd2llm.command("stats")
+    async def show_stats(self, event: AstrMessageEvent, target: str = ""):
+        '''查看执行指标
+        
+        格式：/cmd2llm stats [指令名|reset]
+        '''
+        if target == "reset":
+            async for result in self.command_processor.reset_stats(event):
+                yield result
+        else:
+            command_name = target.replace("--", " ") if target else None
+            async for result in self.command_processor.show_stats(event, command_name):
+                yield result
+
     @cmd2llm.command("help")
     async def show_help(self, event: AstrMessageEvent):
         '''显示帮助信息'''
@@ -99,7 +188,13 @@ class CommandToLLM(Star):
 /cmd2llm add <指令名> <LLM函数名> [描述] - 添加指令映射
 /cmd2llm ls - 列出所有指令映射
 /cmd2llm rm <指令名> - 删除指令映射
+/cmd2llm set <指令名> <选项> <值> - 设置映射选项（值为 default 时恢复全局配置）
+/cmd2llm import [overwrite] <数据> - 批量导入映射（JSON/YAML/CSV）
+/cmd2llm export [json|yaml|csv] - 批量导出映射
 /cmd2llm exec <指令名> [参数] - 执行指令
+/cmd2llm cache [stats|clear] [指令名] - 查看或清除结果缓存
+/cmd2llm queue - 查看指令执行队列与消息转发状态
+/cmd2llm stats [指令名|reset] - 查看或清空执行指标
 /cmd2llm refresh - 刷新动态LLM函数
 /cmd2llm help - 显示此帮助
 
@@ -108,6 +203,20 @@ class CommandToLLM(Star):
 - 多级指令：rmd--ls, rmd--add, rmd--help
 - 支持任意数量的 -- 连接
 
+映射选项：
+- capture_policy：捕获策略 first/quiet/max_messages/pipeline
+- capture_timeout：最长等待时间（秒）
+- capture_quiet_period：静默期（秒）
+- capture_max_messages：最大捕获条数
+- cache_ttl：结果缓存有效期（秒），0 为不缓存
+- dedup_scope：相同请求合并范围 off/session/user/global
+- max_concurrency：该映射同时执行的上限，0 为不限
+- dispatch_mode：执行方式 queue/direct
+- stream：流式转发 true/false
+- platforms：可用的平台ID，逗号分隔
+- sessions：可用的群号、用户ID或会话标识，逗号分隔
+- roles：可用的用户角色 admin/member，逗号分隔
+
 动态LLM函数：
 添加映射后会自动注册对应的LLM函数，如：
 - 映射 "rmd ls" -> "list_reminders" 会注册 list_reminders 函数
@@ -116,6 +225,7 @@ class CommandToLLM(Star):
 示例：
 /cmd2llm add rmd--ls list_reminders 列出所有提醒
 /cmd2llm add rmd--add add_reminder 添加提醒
+/cmd2llm set rmd--ls capture_policy quiet
 /cmd2llm exec rmd--ls
 /cmd2llm exec rmd--add text=喝水 time=10:00
 """
@@ -125,6 +235,7 @@ class CommandToLLM(Star):
     async def refresh_functions(self, event: AstrMessageEvent):
         '''刷新动态LLM函数'''
         try:
+            self.command_processor.command_executor.command_trigger.dispatcher.invalidate()
             self.dynamic_llm_manager.refresh_functions()
             registered_count = len(self.dynamic_llm_manager.get_registered_functions())
             yield event.plain_result(f"刷新完成，当前注册了 {registered_count} 个动态LLM函数")
@@ -132,4 +243,7 @@ class CommandToLLM(Star):
             logger.error(f"刷新动态LLM函数失败: {e}")
             yield event.plain_result(f"刷新失败：{str(e)}")
 
- 
\ No newline at end of file
+    async def terminate(self):
+        '''插件卸载时发送完待转发的消息，并将未保存的指令映射写入磁盘'''
+        await self.command_processor.close()
+        await self.data_manager.close()
@@ -0,0 +1,177 @@
+import os
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Optional
+from astrbot.api import logger
+from .utils import FileUtils
+
+
+class MappingStore(ABC):
+    """指令映射的存储后端
+
+    load 在插件启动时同步调用；save_all / apply 在线程池中调用，同一时刻只会有一个写入。
+    """
+
+    # 是否支持只写入变化的映射，不支持时每次保存都写入全部映射
+    incremental = False
+
+    @abstractmethod
+    def load(self) -> Dict[str, Dict]:
+        """读取全部映射"""
+
+    @abstractmethod
+    def save_all(self, mappings: Dict[str, Dict]) -> bool:
+        """写入全部映射，返回是否成功"""
+
+    @abstractmethod
+    def apply(self, changes: Dict[str, Optional[Dict]]) -> bool:
+        """增量写入变化的映射，值为None表示删除，返回是否成功"""
+
+    def close(self):
+        """释放存储占用的资源"""
+
+
+class JsonMappingStore(MappingStore):
+    """单个 JSON 文件存储，每次保存原子重写整个文件"""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def load(self) -> Dict[str, Dict]:
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.error(f"加载指令映射配置失败: {e}")
+                return {}
+        return {}
+
+    def save_all(self, mappings: Dict[str, Dict]) -> bool:
+        try:
+            FileUtils.atomic_write_text(self.path, json.dumps(mappings, ensure_ascii=False, indent=2))
+            return True
+        except Exception as e:
+            logger.error(f"保存指令映射配置失败: {e}")
+            return False
+
+    def apply(self, changes: Dict[str, Optional[Dict]]) -> bool:
+        # 文件只能整体重写，读出后合并变化再写回
+        mappings = self.load()
+        for command_name, mapping in changes.items():
+            if mapping is None:
+                mappings.pop(command_name, None)
+            else:
+                mappings[command_name] = mapping
+        return self.save_all(mappings)
+
+
+class SqliteMappingStore(MappingStore):
+    """SQLite 存储，按指令名增量更新和删除，适合映射数量很多的场景
+
+    映射的完整内容以 JSON 保存在 data 列中，指令名为主键，LLM函数名单独成列并建立索引。
+    数据库为空且存在旧的 JSON 文件时自动迁移，迁移后原文件重命名为 .migrated 保留备份。
+    """
+
+    incremental = True
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS mappings ("
+        " command TEXT PRIMARY KEY,"
+        " llm_function TEXT NOT NULL,"
+        " data TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_mappings_llm_function ON mappings (llm_function)",
+    )
+
+    def __init__(self, path: Path, legacy_json: Path = None):
+        self.path = path
+        self.legacy_json = legacy_json
+        self._lock = threading.Lock()  # 连接会在线程池的不同线程中使用
+        self._conn = sqlite3.connect(os.fspath(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+
+    def load(self) -> Dict[str, Dict]:
+        try:
+            with self._lock:
+                rows = self._conn.execute("SELECT command, data FROM mappings ORDER BY rowid").fetchall()
+        except Exception as e:
+            logger.error(f"加载指令映射数据库失败: {e}")
+            return {}
+
+        if not rows and self.legacy_json is not None and os.path.exists(self.legacy_json):
+            return self._migrate()
+
+        mappings = {}
+        for command_name, data in rows:
+            try:
+                mappings[command_name] = json.loads(data)
+            except ValueError as e:
+                logger.error(f"指令 {command_name} 的映射数据损坏，已跳过: {e}")
+        return mappings
+
+    def _migrate(self) -> Dict[str, Dict]:
+        """从旧的 JSON 文件导入映射"""
+        mappings = JsonMappingStore(self.legacy_json).load()
+        if mappings and self.save_all(mappings):
+            try:
+                os.replace(self.legacy_json, f"{os.fspath(self.legacy_json)}.migrated")
+            except OSError as e:
+                logger.warning(f"重命名已迁移的映射文件失败: {e}")
+            logger.info(f"已将 {len(mappings)} 个指令映射从 {self.legacy_json} 迁移到 {self.path}")
+        return mappings
+
+    @staticmethod
+    def _row(command_name: str, mapping: Dict):
+        return command_name, mapping.get("llm_function", ""), json.dumps(mapping, ensure_ascii=False)
+
+    def save_all(self, mappings: Dict[str, Dict]) -> bool:
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM mappings")
+                self._conn.executemany("INSERT INTO mappings (command, llm_function, data) VALUES (?, ?, ?)",
+                                       [self._row(name, mapping) for name, mapping in mappings.items()])
+            return True
+        except Exception as e:
+            logger.error(f"保存指令映射数据库失败: {e}")
+            return False
+
+    def apply(self, changes: Dict[str, Optional[Dict]]) -> bool:
+        upserts = [self._row(name, mapping) for name, mapping in changes.items() if mapping is not None]
+        deletes = [(name,) for name, mapping in changes.items() if mapping is None]
+        try:
+            # 同一事务内完成，失败时整体回滚
+            with self._lock, self._conn:
+                if upserts:
+                    self._conn.executemany(
+                        "INSERT INTO mappings (command, llm_function, data) VALUES (?, ?, ?) "
+                        "ON CONFLICT(command) DO UPDATE SET llm_function = excluded.llm_function, data = excluded.data",
+                        upserts)
+                if deletes:
+                    self._conn.executemany("DELETE FROM mappings WHERE command = ?", deletes)
+            return True
+        except Exception as e:
+            logger.error(f"保存指令映射数据库失败: {e}")
+            return False
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_mapping_store(backend: str, data_dir: Path) -> MappingStore:
+    """按配置创建存储后端，未知后端回退为 JSON"""
+    json_file = data_dir / "command_mappings.json"
+    if backend == "sqlite":
+        try:
+            return SqliteMappingStore(data_dir / "command_mappings.db", legacy_json=json_file)
+        except Exception as e:
+            logger.error(f"打开指令映射数据库失败，改用 JSON 文件存储: {e}")
+    elif backend != "json":
+        logger.warning(f"存储后端 {backend!r} 无效，可用值：json, sqlite，已使用 json")
+    return JsonMappingStore(json_file)
@@ -0,0 +1,29 @@
+import itertools
+import os
+import secrets
+import time
+
+
+class MessageIdGenerator:
+    """伪造消息ID生成器
+
+    ID 格式为 <前缀>_<启动标识>_<序号>：启动标识由进程号、启动时间和随机数组成，
+    序号在进程内单调递增，因此同一秒内创建的事件也不会重复，重启后也不会与之前的ID冲突。
+    """
+
+    def __init__(self, prefix: str = "command_to_llm"):
+        boot_id = f"{os.getpid():x}{int(time.time() * 1000):x}{secrets.token_hex(2)}"
+        self.prefix = f"{prefix}_{boot_id}_"
+        self._counter = itertools.count(1)
+
+    def next_id(self) -> str:
+        """生成下一个消息ID"""
+        return f"{self.prefix}{next(self._counter)}"
+
+    def owns(self, message_id: str) -> bool:
+        """判断消息ID是否由本生成器生成"""
+        return isinstance(message_id, str) and message_id.startswith(self.prefix)
+
+
+# 进程内共享的默认生成器
+message_ids = MessageIdGenerator()
@@ -0,0 +1,171 @@
+import asyncio
+from bisect import bisect_left
+from typing import Dict, List, Optional
+from astrbot.api import logger
+from .utils import FileUtils
+
+
+class Histogram:
+    """固定分桶的延迟直方图（毫秒）"""
+
+    BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """按分桶上界估算分位数，没有数据时返回None"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return float(self.BUCKETS[i]) if i < len(self.BUCKETS) else float("inf")
+        return float("inf")
+
+
+class MappingMetrics:
+    """单个映射的计数与各阶段延迟"""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = dict.fromkeys(Metrics.COUNTERS, 0)
+        self.stages: Dict[str, Histogram] = {stage: Histogram() for stage in Metrics.STAGES}
+
+
+class Metrics:
+    """按映射统计的执行指标，可导出为 Prometheus 文本格式
+
+    阶段延迟：
+    - event_build: 构建伪造事件
+    - admission_wait: 在插件的准入队列中等待执行许可
+    - first_response: 提交到收到第一条响应
+    - capture_total: 提交到捕获结束
+    - forward: 提交转发到发送完成
+
+    事件在 AstrBot 核心事件队列中的等待时间无法从插件侧观测，没有单独统计，包含在 first_response 和 capture_total 中。
+
+    计数：calls 为调用次数（包括命中缓存和合并的调用），empty 为流水线已结束但没有输出，
+    timeouts 为等待响应超时或调用方放弃等待。
+    """
+
+    STAGES = ("event_build", "admission_wait", "first_response", "capture_total", "forward")
+    COUNTERS = ("calls", "success", "empty", "timeouts", "errors", "rejected", "cache_hits", "dedup_shared")
+
+    def __init__(self):
+        self.mappings: Dict[str, MappingMetrics] = {}
+        self._export_task = None
+
+    def _get(self, mapping: str) -> MappingMetrics:
+        metrics = self.mappings.get(mapping)
+        if metrics is None:
+            metrics = self.mappings[mapping] = MappingMetrics()
+        return metrics
+
+    def incr(self, mapping: str, counter: str, value: int = 1):
+        """增加映射的计数"""
+        self._get(mapping).counters[counter] += value
+
+    def observe(self, mapping: str, stage: str, value_ms: Optional[float]):
+        """记录映射某个阶段的耗时，值为空时忽略"""
+        if value_ms is not None:
+            self._get(mapping).stages[stage].observe(value_ms)
+
+    def reset(self):
+        """清空所有指标"""
+        self.mappings.clear()
+
+    def summary(self, mapping: str = None, limit: int = 10) -> List[str]:
+        """按捕获总耗时 p95 从慢到快列出映射的指标摘要"""
+        if mapping is not None:
+            items = [(mapping, self.mappings[mapping])] if mapping in self.mappings else []
+        else:
+            items = sorted(self.mappings.items(),
+                           key=lambda item: item[1].stages["capture_total"].quantile(0.95) or 0, reverse=True)[:limit]
+
+        def fmt(histogram: Histogram, q: float) -> str:
+            value = histogram.quantile(q)
+            if value is None:
+                return "-"
+            return f">{Histogram.BUCKETS[-1]}" if value == float("inf") else f"≤{value:g}"
+
+        lines = []
+        for name, metrics in items:
+            c = metrics.counters
+            lines.append(f"{name}：调用 {c['calls']}，成功 {c['success']}，无输出 {c['empty']}，超时 {c['timeouts']}，错误 {c['errors']}，"
+                         f"拒绝 {c['rejected']}，缓存命中 {c['cache_hits']}，合并 {c['dedup_shared']}")
+            for stage in self.STAGES:
+                histogram = metrics.stages[stage]
+                if histogram.count:
+                    lines.append(f"  {stage}: p50 {fmt(histogram, 0.5)} ms，p95 {fmt(histogram, 0.95)} ms，"
+                                 f"平均 {histogram.sum / histogram.count:.1f} ms（{histogram.count} 次）")
+        return lines
+
+    @staticmethod
+    def _label(value: str) -> str:
+        return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    def render_prometheus(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        for counter in self.COUNTERS:
+            name = f"cmd2llm_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            for mapping, metrics in self.mappings.items():
+                lines.append(f'{name}{{mapping="{self._label(mapping)}"}} {metrics.counters[counter]}')
+
+        name = "cmd2llm_stage_latency_ms"
+        lines.append(f"# TYPE {name} histogram")
+        for mapping, metrics in self.mappings.items():
+            mapping_label = self._label(mapping)
+            for stage, histogram in metrics.stages.items():
+                labels = f'mapping="{mapping_label}",stage="{stage}"'
+                cumulative = 0
+                for bound, count in zip((*Histogram.BUCKETS, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.3f}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def start_export(self, path, interval: float):
+        """定期把指标写入文件，供 node_exporter 文本采集器等读取；间隔为 0 或没有事件循环时不导出"""
+        if interval <= 0:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("没有运行中的事件循环，指标文件导出未启动")
+            return
+        if self._export_task is None or self._export_task.done():
+            self._export_task = loop.create_task(self._export_loop(path, interval))
+            logger.info(f"指标每 {interval} 秒导出到 {path}")
+
+    async def _export_loop(self, path, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.export(path)
+
+    async def export(self, path):
+        """把当前指标原子写入文件，写入在线程池中执行"""
+        text = self.render_prometheus()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, FileUtils.atomic_write_text, path, text)
+        except Exception as e:
+            logger.error(f"导出指标失败: {e}")
+
+    async def stop_export(self, path=None):
+        """停止定期导出，指定路径时最后再写一次"""
+        if self._export_task is not None and not self._export_task.done():
+            self._export_task.cancel()
+            if path is not None:
+                await self.export(path)
+        self._export_task = None
@@ -0,0 +1,127 @@
+import functools
+import importlib
+from typing import Dict, List, Optional, Sequence
+from astrbot.api import logger
+
+
+class PlatformAdapter:
+    """平台适配描述，声明如何识别平台以及如何构造该平台的事件对象
+
+    Args:
+        name: 平台类型名，与平台实例 meta().name 一致
+        event_class_path: 事件类路径，格式为 "模块路径:类名"，首次使用时才导入
+        client_kwargs: 事件构造参数名 -> 平台实例属性名，属性名为 None 时传入平台实例本身
+        keywords: platform_id 包含其中任意一个关键字即匹配（不区分大小写）
+        requires: platform_id 还必须同时包含的关键字
+        requires_platform: 是否需要已加载的平台实例才能构造事件
+    """
+
+    def __init__(self, name: str, event_class_path: str, client_kwargs: Dict[str, Optional[str]] = None,
+                 keywords: Sequence[str] = (), requires: Sequence[str] = (), requires_platform: bool = True):
+        self.name = name
+        self.event_class_path = event_class_path
+        self.client_kwargs = client_kwargs or {}
+        self.keywords = tuple(k.lower() for k in keywords) or (name.lower(),)
+        self.requires = tuple(k.lower() for k in requires)
+        self.requires_platform = requires_platform
+        self._event_class = None
+
+    def matches(self, platform_id_lower: str) -> bool:
+        """判断 platform_id 是否属于该平台"""
+        return (any(k in platform_id_lower for k in self.keywords)
+                and all(k in platform_id_lower for k in self.requires))
+
+    def load_event_class(self):
+        """导入并缓存事件类"""
+        if self._event_class is None:
+            module_path, class_name = self.event_class_path.split(":", 1)
+            self._event_class = getattr(importlib.import_module(module_path), class_name)
+        return self._event_class
+
+    def build_constructor(self, platform) -> Optional[functools.partial]:
+        """绑定平台客户端，返回事件构造器；平台实例不满足要求时返回None"""
+        if self.requires_platform and not platform:
+            return None
+
+        kwargs = {}
+        for kwarg, attr in self.client_kwargs.items():
+            if attr is None:
+                kwargs[kwarg] = platform
+            elif hasattr(platform, attr):
+                kwargs[kwarg] = getattr(platform, attr)
+            else:
+                return None
+        return functools.partial(self.load_event_class(), **kwargs)
+
+    def __repr__(self):
+        return f"PlatformAdapter({self.name}, {self.event_class_path})"
+
+
+_adapters: Dict[str, PlatformAdapter] = {}  # 平台类型 -> 适配描述
+_match_order: List[PlatformAdapter] = []  # 按关键字推断平台类型时的匹配顺序
+_registry_version = 0  # 注册表变化时递增，供解析缓存判断是否过期
+
+
+def register_platform_adapter(adapter: PlatformAdapter, first: bool = False):
+    """注册平台适配，同名平台会被替换
+
+    第三方插件可以调用该函数为新平台提供事件构造方式，无需修改本插件。
+
+    Args:
+        adapter: 平台适配描述
+        first: 是否优先于已注册的平台进行关键字匹配
+    """
+    global _registry_version
+    old = _adapters.get(adapter.name)
+    if old is not None:
+        _match_order.remove(old)
+    _adapters[adapter.name] = adapter
+    if first:
+        _match_order.insert(0, adapter)
+    else:
+        _match_order.append(adapter)
+    _registry_version += 1
+    logger.debug(f"已注册平台适配: {adapter}")
+
+
+def get_platform_adapter(name: str) -> Optional[PlatformAdapter]:
+    """按平台类型获取适配描述"""
+    return _adapters.get(name)
+
+
+def match_platform_adapter(platform_id: str) -> Optional[PlatformAdapter]:
+    """按 platform_id 中的关键字推断平台适配"""
+    platform_id_lower = platform_id.lower()
+    for adapter in _match_order:
+        if adapter.matches(platform_id_lower):
+            return adapter
+    return None
+
+
+def registry_version() -> int:
+    """当前注册表版本"""
+    return _registry_version
+
+
+# 内置平台，顺序即关键字匹配顺序
+for _adapter in (
+    PlatformAdapter("aiocqhttp", "astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event:AiocqhttpMessageEvent",
+                    {"bot": "bot"}, keywords=("aiocqhttp", "onebot")),
+    PlatformAdapter("qq_official", "astrbot.core.platform.sources.qqofficial.qqofficial_message_event:QQOfficialMessageEvent",
+                    {"bot": "client"}, keywords=("qq_official", "qqofficial")),
+    PlatformAdapter("telegram", "astrbot.core.platform.sources.telegram.tg_event:TelegramPlatformEvent",
+                    {"client": "client"}, keywords=("telegram", "tg")),
+    PlatformAdapter("discord", "astrbot.core.platform.sources.discord.discord_platform_event:DiscordPlatformEvent",
+                    {"client": "client"}),
+    PlatformAdapter("slack", "astrbot.core.platform.sources.slack.slack_event:SlackMessageEvent",
+                    {"web_client": "web_client"}),
+    PlatformAdapter("lark", "astrbot.core.platform.sources.lark.lark_event:LarkMessageEvent",
+                    {"bot": "bot"}),
+    PlatformAdapter("wechatpadpro", "astrbot.core.platform.sources.wechatpadpro.wechatpadpro_message_event:WeChatPadProMessageEvent",
+                    {"adapter": None}, keywords=("padpro",), requires=("wechat",)),
+    PlatformAdapter("webchat", "astrbot.core.platform.sources.webchat.webchat_event:WebChatMessageEvent",
+                    keywords=("webchat", "wechat"), requires_platform=False),
+    PlatformAdapter("dingtalk", "astrbot.core.platform.sources.dingtalk.dingtalk_event:DingtalkMessageEvent",
+                    {"client": "client"}),
+):
+    register_platform_adapter(_adapter)
@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+
+class ResultCache:
+    """指令结果缓存，条目按 TTL 过期，超出容量时淘汰最久未使用的条目
+
+    缓存键的第一个元素必须是指令名，便于按指令失效。
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max(1, max_size)
+        self._entries: "OrderedDict[Tuple, Tuple[float, str]]" = OrderedDict()  # 键 -> (过期时间, 结果)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[str]:
+        """读取未过期的缓存结果，未命中返回None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Tuple[Hashable, ...], value: str, ttl: float):
+        """写入缓存结果"""
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, command_name: str = None) -> int:
+        """失效指定指令的缓存，不指定时清空全部缓存
+
+        Returns:
+            被移除的条目数
+        """
+        if command_name is None:
+            count = len(self._entries)
+            self._entries.clear()
+            return count
+
+        keys = [key for key in self._entries if key[0] == command_name]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def stats(self) -> Dict[str, float]:
+        """缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,86 @@
+from typing import Dict, FrozenSet, Optional, Tuple
+
+
+class MappingScope:
+    """单个映射的可用范围，各项为空表示不限制"""
+
+    __slots__ = ("platforms", "sessions", "roles")
+
+    def __init__(self, platforms: FrozenSet[str], sessions: FrozenSet[str], roles: FrozenSet[str]):
+        self.platforms = platforms
+        self.sessions = sessions  # 会话ID（群号或用户ID）或完整的 unified_msg_origin
+        self.roles = roles
+
+    @classmethod
+    def from_mapping(cls, mapping: Dict) -> Optional["MappingScope"]:
+        """从映射选项构建范围，没有任何限制时返回None"""
+        parts = [frozenset(item for item in str(mapping.get(key) or "").split(",") if item)
+                 for key in ScopeIndex.OPTIONS]
+        if not any(parts):
+            return None
+        return cls(*parts)
+
+    def allows(self, platform: str, session: str, unified_msg_origin: str, role: str) -> bool:
+        if self.platforms and platform not in self.platforms:
+            return False
+        if self.sessions and session not in self.sessions and unified_msg_origin not in self.sessions:
+            return False
+        return not self.roles or role in self.roles
+
+
+class ScopeIndex:
+    """按会话解析映射可用范围的索引
+
+    只记录设置了范围的映射，未设置的映射在所有会话可用。
+    每个 (unified_msg_origin, 角色) 第一次解析时计算一次不可用的映射集合并缓存，
+    之后同一会话的解析只需一次字典查找；任何映射的范围变化时清空缓存。
+    """
+
+    # 映射上表示范围的选项
+    OPTIONS = ("platforms", "sessions", "roles")
+
+    # 最多缓存的会话数，超出时整体清空
+    MAX_CACHED = 4096
+
+    def __init__(self):
+        self.scopes: Dict[str, MappingScope] = {}  # 指令名 -> 范围
+        self._hidden: Dict[Tuple[str, str], FrozenSet[str]] = {}  # (会话, 角色) -> 不可用的指令
+
+    def update(self, command_name: str, mapping: Dict):
+        """映射新增或修改后更新其范围"""
+        scope = MappingScope.from_mapping(mapping)
+        if scope is None:
+            self.remove(command_name)
+            return
+        self.scopes[command_name] = scope
+        self._hidden.clear()
+
+    def remove(self, command_name: str):
+        """映射删除后移除其范围"""
+        if self.scopes.pop(command_name, None) is not None:
+            self._hidden.clear()
+
+    @staticmethod
+    def split_origin(unified_msg_origin: str) -> Tuple[str, str]:
+        """从 unified_msg_origin（平台ID:消息类型:会话ID）取出平台ID和会话ID"""
+        platform, _, rest = unified_msg_origin.partition(":")
+        return platform, rest.partition(":")[2]
+
+    def hidden(self, unified_msg_origin: str, role: str = "member") -> FrozenSet[str]:
+        """当前会话和角色下不可用的指令名"""
+        key = (unified_msg_origin, role)
+        hidden = self._hidden.get(key)
+        if hidden is None:
+            if not self.scopes:
+                return frozenset()
+            platform, session = self.split_origin(unified_msg_origin)
+            hidden = frozenset(name for name, scope in self.scopes.items()
+                               if not scope.allows(platform, session, unified_msg_origin, role))
+            if len(self._hidden) >= self.MAX_CACHED:
+                self._hidden.clear()
+            self._hidden[key] = hidden
+        return hidden
+
+    def allows(self, command_name: str, unified_msg_origin: str, role: str = "member") -> bool:
+        """指令在当前会话和角色下是否可用"""
+        return command_name not in self.scopes or command_name not in self.hidden(unified_msg_origin, role)
@@ -0,0 +1,171 @@
+import time
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from astrbot.api import logger
+from astrbot.api.message_components import Plain
+from astrbot.core.message.message_event_result import MessageChain
+
+
+class TokenBucket:
+    """令牌桶，按先来先到预约发送时间，无需加锁"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate  # 每秒补充的令牌数，0 为不限速
+        self.burst = max(1, burst)  # 桶容量，即允许连续发送的条数
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """取走一个令牌，返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class SendScheduler:
+    """按平台限速的消息发送调度器
+
+    每个 platform_id 使用独立的令牌桶，在平台允许的速率内尽快发送，
+    取代固定的消息间隔；连续的纯文本消息可以合并为一条发送，是否合并同样可以按平台设置。
+    """
+
+    # 合并后单条消息的最大字符数
+    MERGE_MAX_CHARS = 2000
+
+    # 平台限速配置中表示是否合并的取值
+    MERGE_FLAGS = {"on": True, "true": True, "1": True, "off": False, "false": False, "0": False}
+
+    def __init__(self, context, default_limit: Tuple[float, int] = (2.0, 3),
+                 limits: Optional[Dict[str, Tuple[float, int]]] = None, merge_plain: bool = True,
+                 merge_platforms: Optional[Dict[str, bool]] = None):
+        self.context = context
+        self.default_limit = default_limit
+        self.limits = limits or {}  # platform_id -> (速率, 容量)
+        self.merge_plain = merge_plain  # 未单独设置的平台是否合并
+        self.merge_platforms = merge_platforms or {}  # platform_id -> 是否合并
+        self._buckets: Dict[str, TokenBucket] = {}
+
+        # 指标
+        self.sent = 0
+        self.merged = 0
+        self.throttled = 0
+
+    @classmethod
+    def from_config(cls, context, config) -> "SendScheduler":
+        """从插件配置构建发送调度器
+
+        限速格式为 "速率/容量"，如 "2/3"；按平台设置时为 "platform_id=速率/容量[/on|off]"，
+        最后一项覆盖该平台是否合并纯文本消息，省略时使用 send_merge_plain。
+        """
+        config = config or {}
+        default_limit = cls.parse_limit(str(config.get("send_rate_limit", "2/3"))) or (2.0, 3)
+
+        limits = {}
+        merge_platforms = {}
+        for item in config.get("send_rate_limits", []) or []:
+            platform_id, _, spec = str(item).partition("=")
+            platform_id = platform_id.strip()
+            parts = spec.split("/")
+            limit = cls.parse_limit("/".join(parts[:2]))
+            merge = cls.MERGE_FLAGS.get(parts[2].strip().lower()) if len(parts) == 3 else None
+            if not platform_id or limit is None or len(parts) > 3 or (len(parts) == 3 and merge is None):
+                logger.warning(f"平台限速配置 '{item}' 无效，格式应为 platform_id=速率/容量[/on|off]")
+                continue
+            limits[platform_id] = limit
+            if merge is not None:
+                merge_platforms[platform_id] = merge
+
+        return cls(context, default_limit, limits, bool(config.get("send_merge_plain", True)), merge_platforms)
+
+    @staticmethod
+    def parse_limit(spec: str) -> Optional[Tuple[float, int]]:
+        """解析 "速率/容量"，只写速率时容量为 1，无效时返回None"""
+        rate, _, burst = spec.strip().partition("/")
+        try:
+            rate = float(rate)
+            burst = int(burst) if burst else 1
+        except ValueError:
+            return None
+        if rate < 0 or burst < 1:
+            return None
+        return rate, burst
+
+    @staticmethod
+    def _platform_id(unified_msg_origin: str) -> str:
+        return unified_msg_origin.split(":", 1)[0]
+
+    def _bucket(self, platform_id: str) -> TokenBucket:
+        bucket = self._buckets.get(platform_id)
+        if bucket is None:
+            bucket = TokenBucket(*self.limits.get(platform_id, self.default_limit))
+            self._buckets[platform_id] = bucket
+        return bucket
+
+    async def send(self, unified_msg_origin: str, message_chain: MessageChain):
+        """在平台限速内发送一条消息"""
+        delay = self._bucket(self._platform_id(unified_msg_origin)).reserve()
+        if delay > 0:
+            self.throttled += 1
+            await asyncio.sleep(delay)
+        await self.context.send_message(unified_msg_origin, message_chain)
+        self.sent += 1
+
+    async def send_all(self, unified_msg_origin: str, message_chains: List[MessageChain]):
+        """按顺序发送多条消息，连续的纯文本消息先合并"""
+        for message_chain in self.merge(unified_msg_origin, message_chains):
+            await self.send(unified_msg_origin, message_chain)
+
+    def merge_enabled(self, unified_msg_origin: str) -> bool:
+        """会话所在平台是否合并纯文本消息"""
+        return self.merge_platforms.get(self._platform_id(unified_msg_origin), self.merge_plain)
+
+    def merge(self, unified_msg_origin: str, message_chains: List[MessageChain]) -> List[MessageChain]:
+        """合并发往该会话的连续纯文本消息，所在平台未启用合并时原样返回"""
+        if len(message_chains) < 2 or not self.merge_enabled(unified_msg_origin):
+            return list(message_chains)
+
+        merged: List[MessageChain] = []
+        pending: List[str] = []  # 待合并的文本
+        pending_chars = 0
+
+        def flush():
+            if pending:
+                merged.append(MessageChain([Plain("\n".join(pending))]))
+                self.merged += len(pending) - 1
+                pending.clear()
+
+        for message_chain in message_chains:
+            text = self._plain_text(message_chain)
+            if text is None:
+                flush()
+                pending_chars = 0
+                merged.append(message_chain)
+                continue
+            if pending and pending_chars + len(text) > self.MERGE_MAX_CHARS:
+                flush()
+                pending_chars = 0
+            pending.append(text)
+            pending_chars += len(text)
+        flush()
+        return merged
+
+    @staticmethod
+    def _plain_text(message_chain) -> Optional[str]:
+        """消息只包含纯文本时返回其文本，否则返回None"""
+        chain = getattr(message_chain, "chain", None)
+        if not chain or not all(isinstance(component, Plain) for component in chain):
+            return None
+        return "".join(component.text for component in chain)
+
+    def snapshot(self) -> Dict[str, int]:
+        """发送计数指标"""
+        return {
+            "sent": self.sent,
+            "merged": self.merged,
+            "throttled": self.throttled,
+            "platforms": len(self._buckets),
+        }
@@ -0,0 +1,120 @@
+import re
+from typing import Callable, Dict, Optional
+from astrbot.api import message_components as Comp
+
+
+def _named(label: str, *attrs: str) -> Callable:
+    """生成带名称的占位符渲染函数，如 [文件:report.pdf]"""
+    def render(component) -> str:
+        for attr in attrs:
+            value = getattr(component, attr, None)
+            if value:
+                return f"[{label}:{value}]"
+        return f"[{label}]"
+    return render
+
+
+def _render_at(component) -> str:
+    return f"@{getattr(component, 'name', None) or getattr(component, 'qq', '')}"
+
+
+def _render_node(component) -> str:
+    """合并转发中的单条消息"""
+    sender = getattr(component, "name", None) or getattr(component, "uin", "")
+    text = "".join(TextExtractor.render(part) for part in (getattr(component, "content", None) or []))
+    return f"{sender}: {text}" if sender else text
+
+
+def _render_nodes(component) -> str:
+    return "\n".join(_render_node(node) for node in (getattr(component, "nodes", None) or []))
+
+
+# 组件类名 -> 渲染函数，非文本组件渲染为占位符，缺失的组件类型会被跳过
+_RENDERERS_BY_NAME: Dict[str, Callable] = {
+    "Plain": lambda component: component.text,
+    "At": _render_at,
+    "AtAll": lambda component: "@全体成员",
+    "Image": lambda component: "[图片]",
+    "Face": lambda component: "[表情]",
+    "Record": lambda component: "[语音]",
+    "Video": lambda component: "[视频]",
+    "File": _named("文件", "name"),
+    "Share": _named("分享", "title", "url"),
+    "Location": _named("位置", "title"),
+    "Json": lambda component: "[卡片消息]",
+    "Poke": lambda component: "[戳一戳]",
+    "Reply": lambda component: "",
+    "Node": _render_node,
+    "Nodes": _render_nodes,
+}
+
+# 中日韩字符，估算 token 数时每个字符按一个 token 计
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+
+class TextExtractor:
+    """按组件类型提取消息链文本，并把返回给LLM的结果限制在字符数和 token 数预算内"""
+
+    # 组件类型 -> 渲染函数
+    RENDERERS: Dict[type, Callable] = {
+        getattr(Comp, name): render for name, render in _RENDERERS_BY_NAME.items() if hasattr(Comp, name)
+    }
+
+    def __init__(self, max_chars: int = 4000, max_tokens: int = 0):
+        self.max_chars = max_chars  # 0 为不限制
+        self.max_tokens = max_tokens  # 0 为不限制
+
+    @classmethod
+    def from_config(cls, config) -> "TextExtractor":
+        """从插件配置构建文本提取器"""
+        config = config or {}
+        return cls(int(config.get("result_max_chars", 4000)), int(config.get("result_max_tokens", 0)))
+
+    @classmethod
+    def render(cls, component) -> str:
+        """渲染单个组件，子类组件按最近的已知父类渲染，未知组件渲染为类名占位符"""
+        component_type = type(component)
+        renderer = cls.RENDERERS.get(component_type)
+        if renderer is None:
+            renderer = next((cls.RENDERERS[base] for base in component_type.__mro__[1:] if base in cls.RENDERERS),
+                            lambda component: f"[{type(component).__name__}]")
+            cls.RENDERERS[component_type] = renderer
+        return renderer(component) or ""
+
+    def extract(self, message_chain) -> Optional[str]:
+        """提取消息链的文本，没有内容时返回None"""
+        chain = getattr(message_chain, "chain", None)
+        if not chain:
+            return None
+        renderers = self.RENDERERS
+        parts = []
+        for component in chain:
+            # 纯文本是最常见的组件，直接取文本
+            if type(component) is Comp.Plain:
+                parts.append(component.text)
+                continue
+            renderer = renderers.get(type(component))
+            parts.append(renderer(component) or "" if renderer is not None else self.render(component))
+        text = "".join(parts)
+        return text or None
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """粗略估算 token 数：中日韩字符每字一个 token，其余约每 4 个字符一个 token"""
+        cjk = len(_CJK_PATTERN.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def truncate(self, text: str) -> str:
+        """超出预算时截断文本并附加提示"""
+        limit = len(text)
+        if self.max_chars and limit > self.max_chars:
+            limit = self.max_chars
+        if self.max_tokens:
+            # 按平均每个 token 的字符数换算出字符上限
+            tokens = self.estimate_tokens(text[:limit])
+            if tokens > self.max_tokens:
+                limit = max(1, limit * self.max_tokens // tokens)
+        if limit >= len(text):
+            return text
+        return (f"{text[:limit]}\n……（结果过长，已截断，仅保留前 {limit} / {len(text)} 个字符；"
+                f"如需其余内容，请缩小查询范围或分页获取）")
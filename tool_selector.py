@@ -0,0 +1,114 @@
+import re
+import math
+import heapq
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+# 英文单词与数字，或连续的中日韩字符
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+_CAMEL_PATTERN = re.compile(r"([a-z0-9])([A-Z])")
+
+
+def tokenize(text: str) -> List[str]:
+    """切分检索词：英文按单词（拆开下划线和驼峰，去掉复数 s），中日韩文本按相邻两字切分"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(_CAMEL_PATTERN.sub(r"\1 \2", text).lower()):
+        if run.isascii():
+            if len(run) > 3 and run.endswith("s") and not run.endswith("ss"):
+                run = run[:-1]
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class ToolSelector:
+    """按与用户消息的相关度挑选动态函数的 BM25 索引
+
+    文档为每个已注册的函数（函数名、指令名和描述），随函数注册、更新、注销增量维护，
+    查询只遍历用户消息中出现的词的倒排表，不需要外部服务。
+    """
+
+    # BM25 参数
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, top_k: int = 8):
+        self.top_k = max(1, top_k)
+        self._postings: Dict[str, Dict[str, int]] = {}  # 词 -> {函数名: 词频}
+        self._doc_terms: Dict[str, Counter] = {}  # 函数名 -> 词频
+        self._doc_lengths: Dict[str, int] = {}  # 函数名 -> 词数
+        self._total_length = 0
+
+    @classmethod
+    def from_config(cls, config) -> Optional["ToolSelector"]:
+        """从插件配置构建选择器，未启用时返回None"""
+        config = config or {}
+        if not config.get("tool_selector_enabled", False):
+            return None
+        return cls(int(config.get("tool_selector_top_k", 8)))
+
+    def update(self, llm_function: str, command_name: str, description: str):
+        """添加或更新函数的索引"""
+        self.remove(llm_function)
+        terms = Counter(tokenize(f"{llm_function} {command_name} {description}"))
+        self._doc_terms[llm_function] = terms
+        self._doc_lengths[llm_function] = sum(terms.values())
+        self._total_length += self._doc_lengths[llm_function]
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[llm_function] = tf
+
+    def remove(self, llm_function: str):
+        """移除函数的索引"""
+        terms = self._doc_terms.pop(llm_function, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_lengths.pop(llm_function)
+        for term in terms:
+            docs = self._postings[term]
+            del docs[llm_function]
+            if not docs:
+                del self._postings[term]
+
+    def scores(self, query: str) -> Dict[str, float]:
+        """计算与查询相关的函数得分，不相关的函数不出现在结果中"""
+        return self._score_terms(set(tokenize(query)))
+
+    def _score_terms(self, terms) -> Dict[str, float]:
+        n = len(self._doc_terms)
+        if not n:
+            return {}
+        avg_length = self._total_length / n or 1
+        scores: Dict[str, float] = {}
+        for term in terms:
+            docs = self._postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for llm_function, tf in docs.items():
+                norm = self.K1 * (1 - self.B + self.B * self._doc_lengths[llm_function] / avg_length)
+                scores[llm_function] = scores.get(llm_function, 0.0) + idf * tf * (self.K1 + 1) / (tf + norm)
+        return scores
+
+    def select(self, query: str, allowed: Callable[[str], bool] = None) -> Optional[List[str]]:
+        """按相关度返回最多 top_k 个函数名
+
+        Args:
+            query: 用户消息
+            allowed: 过滤函数，只在返回True的函数中挑选
+
+        Returns:
+            函数名列表；查询中没有可检索的词，或没有任何函数与之相关（如“好的，继续吧”这类追问）时
+            返回None，表示不做筛选，不会把动态函数全部过滤掉
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return None
+        scores = self._score_terms(terms)
+        candidates = [(name, score) for name, score in scores.items()
+                      if score > 0 and (allowed is None or allowed(name))]
+        if not candidates:
+            return None
+        return [name for name, _ in heapq.nlargest(self.top_k, candidates, key=lambda item: item[1])]
@@ -0,0 +1,74 @@
+import random
+import itertools
+from contextvars import ContextVar, Token
+from typing import Optional
+from astrbot.api import logger
+
+# 当前调用的追踪ID：None 表示不在调用中，空字符串表示该调用未被采样
+_current_trace: ContextVar[Optional[str]] = ContextVar("cmd2llm_trace", default=None)
+
+
+class Tracer:
+    """执行路径上的分级、采样追踪日志
+
+    默认关闭，关闭或未被采样时只做一次整数比较，不格式化消息。
+    消息使用 % 风格的参数，只有真正输出时才格式化；
+    每次工具调用分配一个追踪ID，同一调用（包括其派生的任务）的日志带有相同的ID。
+    """
+
+    OFF = 0
+    INFO = 1
+    DEBUG = 2
+    LEVELS = {"off": OFF, "info": INFO, "debug": DEBUG}
+
+    def __init__(self, level: str = "off", sample_rate: float = 1.0):
+        self.level = self.LEVELS.get(level, self.OFF)
+        self.sample_rate = sample_rate
+        self._ids = itertools.count(1)
+
+    def configure(self, config):
+        """从插件配置读取追踪级别与采样率"""
+        config = config or {}
+        level = str(config.get("trace_level", "off")).lower()
+        if level not in self.LEVELS:
+            logger.warning(f"追踪级别 {level!r} 无效，可用值：{', '.join(self.LEVELS)}，已关闭追踪")
+        self.level = self.LEVELS.get(level, self.OFF)
+        try:
+            self.sample_rate = min(1.0, max(0.0, float(config.get("trace_sample_rate", 1.0))))
+        except (TypeError, ValueError):
+            self.sample_rate = 1.0
+
+    def begin(self) -> Optional[Token]:
+        """开始一次调用的追踪并决定是否采样，已在追踪中时沿用当前ID
+
+        Returns:
+            用于 end 的令牌，未开始新的追踪时为None
+        """
+        if self.level == self.OFF or _current_trace.get() is not None:
+            return None
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        return _current_trace.set(f"{next(self._ids):x}" if sampled else "")
+
+    def end(self, token: Optional[Token]):
+        """结束 begin 开始的追踪"""
+        if token is not None:
+            _current_trace.reset(token)
+
+    def info(self, msg: str, *args):
+        if self.level >= self.INFO:
+            self._emit(msg, args)
+
+    def debug(self, msg: str, *args):
+        if self.level >= self.DEBUG:
+            self._emit(msg, args)
+
+    @staticmethod
+    def _emit(msg: str, args: tuple):
+        trace_id = _current_trace.get()
+        if trace_id == "":
+            return
+        logger.info(f"[cmd2llm {trace_id or '-'}] {msg % args if args else msg}")
+
+
+# 插件全局追踪器
+tracer = Tracer()
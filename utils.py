@@ -1,6 +1,67 @@
-from typing import Dict, List
+import io
+import os
+import csv
+import json
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _parse_bool(value) -> bool:
+    """解析布尔选项，接受 true/false、on/off、yes/no、1/0"""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("true", "on", "yes", "1"):
+        return True
+    if text in ("false", "off", "no", "0"):
+        return False
+    raise ValueError(value)
+
+
+def _parse_list(value) -> str:
+    """解析逗号分隔的列表选项（也接受列表），去重后保存为逗号分隔的字符串"""
+    items = value if isinstance(value, (list, tuple)) else str(value).split(",")
+    parsed = list(dict.fromkeys(str(item).strip() for item in items if str(item).strip()))
+    if not parsed:
+        raise ValueError(value)
+    return ",".join(parsed)
+
+
+def _parse_roles(value) -> str:
+    """解析角色列表，可选 admin、member"""
+    parsed = _parse_list(value).lower()
+    if any(role not in ("admin", "member") for role in parsed.split(",")):
+        raise ValueError(value)
+    return parsed
+
 
 class CommandUtils:
+    # 可在单个指令映射上覆盖的选项及其类型
+    MAPPING_OPTIONS = {
+        "capture_policy": str,
+        "capture_timeout": float,
+        "capture_quiet_period": float,
+        "capture_max_messages": int,
+        "cache_ttl": float,
+        "dedup_scope": str,
+        "max_concurrency": int,
+        "dispatch_mode": str,
+        "stream": _parse_bool,
+        "platforms": _parse_list,
+        "sessions": _parse_list,
+        "roles": _parse_roles,
+    }
+    
+    # 插件自身占用的LLM函数名，映射不能使用
+    RESERVED_FUNCTIONS = ("run_commands",)
+    
+    # 选项的可选值
+    MAPPING_OPTION_CHOICES = {
+        "capture_policy": ("first", "quiet", "max_messages", "pipeline"),
+        "dedup_scope": ("off", "session", "user", "global"),
+        "dispatch_mode": ("queue", "direct"),
+    }
+
     @staticmethod
     def parse_command_args(args_str: str) -> Dict[str, str]:
         """解析命令参数
@@ -47,6 +108,22 @@ class CommandUtils:
         args_str = ' '.join([f"{k}={v}" for k, v in args.items()])
         return f"{command_name} {args_str}"
 
+    @staticmethod
+    def extract_payload(message_str: str, keyword: str) -> str:
+        """提取消息中子指令之后的全部原始文本（保留换行）
+        
+        Args:
+            message_str: 完整消息，如 "cmd2llm import\n{...}"
+            keyword: 子指令名，如 "import"
+            
+        Returns:
+            子指令之后的文本，找不到子指令时返回空字符串
+        """
+        index = message_str.find(keyword)
+        if index < 0:
+            return ""
+        return message_str[index + len(keyword):].strip()
+
     @staticmethod
     def validate_mapping(command_name: str, llm_function: str) -> List[str]:
         """验证映射参数
@@ -65,9 +142,160 @@ class CommandUtils:
         
         if not llm_function or not llm_function.strip():
             errors.append("LLM函数名称不能为空")
+        elif llm_function.strip() in CommandUtils.RESERVED_FUNCTIONS:
+            errors.append(f"LLM函数名称 '{llm_function}' 已被插件保留")
         
         # 移除空格验证，因为多级指令名可以包含空格
         # if command_name and ' ' in command_name:
         #     errors.append("命令名称不能包含空格")
         
-        return errors 
\ No newline at end of file
+        return errors 
+
+    @staticmethod
+    def parse_mapping_option(key: str, value: str) -> Tuple[Any, List[str]]:
+        """解析指令映射选项的值
+        
+        Args:
+            key: 选项名称
+            value: 选项值字符串
+            
+        Returns:
+            (解析后的值, 错误信息列表)
+        """
+        if key not in CommandUtils.MAPPING_OPTIONS:
+            return None, [f"未知选项 '{key}'，可用选项：{', '.join(CommandUtils.MAPPING_OPTIONS)}"]
+        
+        try:
+            parsed = CommandUtils.MAPPING_OPTIONS[key](value)
+        except (TypeError, ValueError):
+            return None, [f"选项 '{key}' 的值 '{value}' 格式不正确"]
+        
+        choices = CommandUtils.MAPPING_OPTION_CHOICES.get(key)
+        if choices and parsed not in choices:
+            return None, [f"选项 '{key}' 的值必须是 {', '.join(choices)} 之一"]
+        
+        if isinstance(parsed, (int, float)) and parsed < 0:
+            return None, [f"选项 '{key}' 的值不能为负数"]
+        
+        return parsed, []
+
+
+class FileUtils:
+    @staticmethod
+    def atomic_write_text(path, text: str):
+        """原子地写入文本文件
+        
+        先写入同目录下的临时文件并落盘，再通过 rename 替换目标文件，
+        崩溃时目标文件要么是旧内容要么是新内容，不会出现写了一半的文件。
+        
+        Args:
+            path: 目标文件路径
+            text: 文件内容
+        """
+        path = os.fspath(path)
+        directory = os.path.dirname(path) or "."
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class MappingSerializer:
+    """指令映射的批量导入导出格式转换，支持 JSON、YAML、CSV"""
+    
+    FORMATS = ("json", "yaml", "csv")
+    
+    # 导出时的基础字段，其余字段为映射选项
+    BASE_FIELDS = ("command", "llm_function", "description")
+    
+    @staticmethod
+    def detect_format(text: str) -> str:
+        """根据内容推断格式"""
+        stripped = text.lstrip()
+        if stripped.startswith(("{", "[")):
+            return "json"
+        first_line = stripped.split("\n", 1)[0]
+        if "," in first_line and "llm_function" in first_line and ":" not in first_line:
+            return "csv"
+        return "yaml"
+    
+    @staticmethod
+    def loads(text: str, fmt: Optional[str] = None) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """解析批量映射数据
+        
+        支持两种结构：
+        - 与 command_mappings.json 相同的 {指令名: {llm_function, description, ...}}
+        - 列表 [{command, llm_function, description, ...}]
+        CSV 需要包含 command、llm_function 列，其他列作为描述或映射选项。
+        
+        Args:
+            text: 数据文本
+            fmt: 格式，为空时自动推断
+            
+        Returns:
+            (映射条目列表, 错误信息列表)，每个条目都包含 command 字段
+        """
+        fmt = (fmt or MappingSerializer.detect_format(text)).lower()
+        try:
+            if fmt == "json":
+                data = json.loads(text)
+            elif fmt == "yaml":
+                try:
+                    import yaml
+                except ImportError:
+                    return [], ["解析 YAML 需要安装 PyYAML"]
+                data = yaml.safe_load(text)
+            elif fmt == "csv":
+                rows = csv.DictReader(io.StringIO(text.strip()))
+                data = [{k.strip(): (v or "").strip() for k, v in row.items() if k and v not in (None, "")} for row in rows]
+            else:
+                return [], [f"不支持的格式 '{fmt}'，可用格式：{', '.join(MappingSerializer.FORMATS)}"]
+        except Exception as e:
+            return [], [f"解析 {fmt.upper()} 数据失败: {e}"]
+        
+        if isinstance(data, dict):
+            items = []
+            for command, mapping in data.items():
+                if not isinstance(mapping, dict):
+                    return [], [f"指令 '{command}' 的映射格式不正确"]
+                items.append({**mapping, "command": command})
+        elif isinstance(data, list):
+            items = data
+        else:
+            return [], ["数据必须是映射对象或映射列表"]
+        
+        errors = []
+        for i, item in enumerate(items, 1):
+            if not isinstance(item, dict):
+                errors.append(f"第 {i} 项不是映射对象")
+            elif not item.get("command"):
+                errors.append(f"第 {i} 项缺少 command 字段")
+        return (items if not errors else []), errors
+    
+    @staticmethod
+    def dumps(mappings: Dict[str, Dict], fmt: str = "json") -> str:
+        """将指令映射导出为文本"""
+        fmt = fmt.lower()
+        if fmt == "json":
+            return json.dumps(mappings, ensure_ascii=False, indent=2)
+        if fmt == "yaml":
+            import yaml
+            return yaml.safe_dump(mappings, allow_unicode=True, sort_keys=False)
+        if fmt == "csv":
+            option_fields = sorted({key for mapping in mappings.values() for key in mapping
+                                    if key in CommandUtils.MAPPING_OPTIONS})
+            output = io.StringIO()
+            writer = csv.DictWriter(output, fieldnames=[*MappingSerializer.BASE_FIELDS, *option_fields],
+                                    extrasaction="ignore", lineterminator="\n")
+            writer.writeheader()
+            for command, mapping in mappings.items():
+                writer.writerow({**mapping, "command": command})
+            return output.getvalue()
+        raise ValueError(f"不支持的格式 '{fmt}'，可用格式：{', '.join(MappingSerializer.FORMATS)}")